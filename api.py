@@ -0,0 +1,276 @@
+"""Versioned JSON API for Blogly, mounted at /api/v1.
+
+Collections are keyset-paginated on id and every resource supports:
+
+    ?fields=title,user_id         sparse fieldset for the requested type
+    ?fields[users]=first_name     sparse fieldset for any type, e.g. included ones
+    ?include=user,tags            related objects, loaded with one query per relation
+
+Only the id and the requested columns are selected, never whole entities.
+Related objects come back under "included", keyed by type, and each
+primary object names its related ids under the relationship's name, e.g.
+a post's "user" and "tags". To-many relationships list at most
+API_INCLUDE_LIMIT ids per object; when there are more, the object's
+"links" holds the URL of the next page of them.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from flask import Blueprint, abort, current_app, jsonify, request, stream_with_context, url_for
+from werkzeug.exceptions import HTTPException
+
+from export import FORMATS, TABLES, export_rows
+from models import db, User, Post, Tag, PostTag
+from pagination import encode_cursor, keyset_paginate, per_page_arg
+
+api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+MODELS = {'users': User, 'posts': Post, 'tags': Tag}
+FIELDS = {
+    'users': ('first_name', 'last_name', 'image_url', 'updated_at'),
+    'posts': ('title', 'content', 'created_at', 'updated_at', 'user_id'),
+    'tags': ('name', 'post_count', 'updated_at'),
+}
+RELATIONSHIPS = {
+    'users': ('posts',),
+    'posts': ('user', 'tags'),
+    'tags': ('posts',),
+}
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def fields_arg(type_, primary=False):
+    """Read the sparse fieldset for `type_`, defaulting to every field."""
+    value = request.args.get(f'fields[{type_}]')
+    if value is None and primary:
+        value = request.args.get('fields')
+    if value is None:
+        return FIELDS[type_]
+    fields = set(_split(value)) - {'id'}
+    unknown = fields - set(FIELDS[type_])
+    if unknown:
+        abort(400, f"Unknown {type_} fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in FIELDS[type_] if field in fields)
+
+
+def include_arg(type_):
+    """Read ?include= for `type_`, aborting with 400 on unknown relationships."""
+    include = _split(request.args.get('include', ''))
+    unknown = set(include) - set(RELATIONSHIPS[type_])
+    if unknown:
+        abort(400, f"Unknown {type_} relationships: {', '.join(sorted(unknown))}")
+    return include
+
+
+def _columns(type_, fields, extra=()):
+    model = MODELS[type_]
+    names = dict.fromkeys(('id', *fields, *extra))
+    return [getattr(model, name) for name in names]
+
+
+def _query(type_, fields, extra=()):
+    return db.session.query(*_columns(type_, fields, extra))
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def serialize(row, fields):
+    obj = {'id': row.id}
+    obj.update((field, _value(getattr(row, field))) for field in fields)
+    return obj
+
+
+def _load(type_, ids):
+    """Load the included objects of `type_` with the given ids."""
+    if not ids:
+        return []
+    fields = fields_arg(type_)
+    rows = _query(type_, fields).filter(MODELS[type_].id.in_(ids)).order_by(MODELS[type_].id).all()
+    return [serialize(row, fields) for row in rows]
+
+
+# type -> (owner column, related id column, URL of the related ids after one)
+TO_MANY = {
+    'posts': (
+        PostTag.post_id, PostTag.tag_id,
+        lambda id, last: url_for('api_v1.post_tags', post_id=id, after=encode_cursor((id, last))),
+    ),
+    'tags': (
+        PostTag.tag_id, PostTag.post_id,
+        lambda id, last: url_for('api_v1.post_tags', tag_id=id, after=encode_cursor((id, last))),
+    ),
+    'users': (
+        Post.user_id, Post.id,
+        lambda id, last: url_for('api_v1.posts', user_id=id, after=encode_cursor((last,))),
+    ),
+}
+
+
+def _include(type_, rows, objects, include):
+    """Attach relationship ids to `objects` and return the included objects."""
+    included = {}
+    ids = [row.id for row in rows]
+    for name in include:
+        if type_ == 'posts' and name == 'user':
+            for row, obj in zip(rows, objects):
+                obj['user'] = row.user_id
+            included['users'] = _load('users', {row.user_id for row in rows})
+            continue
+
+        owner, related_id, more = TO_MANY[type_]
+        limit = current_app.config['API_INCLUDE_LIMIT']
+        links = defaultdict(list)
+        if ids:
+            # At most limit + 1 per owner, to tell whether there are more
+            position = db.func.row_number().over(partition_by=owner, order_by=related_id).label('position')
+            ranked = db.session.query(owner.label('owner'), related_id.label('related'), position).filter(
+                owner.in_(ids)
+            ).subquery()
+            pairs = db.session.query(ranked.c.owner, ranked.c.related).filter(
+                ranked.c.position <= limit + 1
+            ).order_by(ranked.c.owner, ranked.c.related)
+            for owner_value, related_value in pairs:
+                links[owner_value].append(related_value)
+
+        for obj in objects:
+            values = links[obj['id']]
+            if len(values) > limit:
+                del values[limit:]
+                obj.setdefault('links', {})[name] = more(obj['id'], values[-1])
+            obj[name] = values
+        related = 'posts' if name == 'posts' else 'tags'
+        included[related] = _load(related, {value for values in links.values() for value in values})
+    return included
+
+
+def _linkage(type_, include):
+    """Columns needed beyond the fieldset to resolve `include`."""
+    return ('user_id',) if type_ == 'posts' and 'user' in include else ()
+
+
+def list_resource(type_, *criteria):
+    fields = fields_arg(type_, primary=True)
+    include = include_arg(type_)
+    model = MODELS[type_]
+    page = keyset_paginate(
+        _query(type_, fields, _linkage(type_, include)).filter(*criteria),
+        (model.id,),
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=per_page_arg(current_app.config['API_PER_PAGE']),
+    )
+    objects = [serialize(row, fields) for row in page]
+    body = {'data': objects}
+    if include:
+        body['included'] = _include(type_, page.items, objects, include)
+    body['next'] = page.next_cursor
+    body['prev'] = page.prev_cursor
+    return jsonify(body)
+
+
+def get_resource(type_, id):
+    fields = fields_arg(type_, primary=True)
+    include = include_arg(type_)
+    model = MODELS[type_]
+    row = _query(type_, fields, _linkage(type_, include)).filter(model.id == id).first()
+    if row is None:
+        abort(404)
+    obj = serialize(row, fields)
+    body = {'data': obj}
+    if include:
+        body['included'] = _include(type_, [row], [obj], include)
+    return jsonify(body)
+
+
+@api_v1.errorhandler(HTTPException)
+def http_error(error):
+    return jsonify({'error': error.description}), error.code
+
+
+@api_v1.route('/users')
+def users():
+    """List users"""
+    return list_resource('users')
+
+
+@api_v1.route('/users/<int:user_id>')
+def user(user_id):
+    """Show a user"""
+    return get_resource('users', user_id)
+
+
+@api_v1.route('/posts')
+def posts():
+    """List posts, optionally only those of ?user_id="""
+    user_id = request.args.get('user_id', type=int)
+    if user_id is not None:
+        return list_resource('posts', Post.user_id == user_id)
+    return list_resource('posts')
+
+
+@api_v1.route('/posts/<int:post_id>')
+def post(post_id):
+    """Show a post"""
+    return get_resource('posts', post_id)
+
+
+@api_v1.route('/tags')
+def tags():
+    """List tags"""
+    return list_resource('tags')
+
+
+@api_v1.route('/tags/<int:tag_id>')
+def tag(tag_id):
+    """Show a tag"""
+    return get_resource('tags', tag_id)
+
+
+@api_v1.route('/post-tags')
+def post_tags():
+    """List post-tag memberships, optionally for one ?post_id= or ?tag_id="""
+    query = db.session.query(PostTag.post_id, PostTag.tag_id)
+    post_id = request.args.get('post_id', type=int)
+    tag_id = request.args.get('tag_id', type=int)
+    if post_id is not None:
+        query = query.filter(PostTag.post_id == post_id)
+    if tag_id is not None:
+        # Walk the (tag_id, post_id) index instead of the primary key
+        columns = (PostTag.tag_id, PostTag.post_id)
+        query = query.filter(PostTag.tag_id == tag_id)
+    else:
+        columns = (PostTag.post_id, PostTag.tag_id)
+    page = keyset_paginate(
+        query,
+        columns,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=per_page_arg(current_app.config['API_PER_PAGE']),
+    )
+    return jsonify({
+        'data': [{'post_id': row.post_id, 'tag_id': row.tag_id} for row in page],
+        'next': page.next_cursor,
+        'prev': page.prev_cursor,
+    })
+
+
+@api_v1.route('/export/<table>')
+def export(table):
+    """Stream a whole table as ?format=ndjson (the default) or csv"""
+    format = request.args.get('format', 'ndjson')
+    if table not in TABLES:
+        abort(404)
+    if format not in FORMATS:
+        abort(400, f"Unknown export format {format!r}")
+    chunks = export_rows(table, format, current_app.config['EXPORT_BATCH_SIZE'])
+    return current_app.response_class(
+        stream_with_context(chunks),
+        mimetype=FORMATS[format],
+        headers={'Content-Disposition': f'attachment; filename={table}.{format}'},
+    )
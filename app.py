@@ -1,38 +1,199 @@
 """Blogly application."""
 
-from flask import Flask, request, redirect, render_template, session, url_for
-from models import db, connect_db, User, Post, Tag
+from flask import Flask, abort, jsonify, request, redirect, render_template, session, url_for
+from sqlalchemy.orm import joinedload, load_only, selectinload
+from models import db, connect_db, User, Post, Tag, PostTag, adjust_tag_post_counts, release_tag_post_counts
+from cli import blogly_cli
+from pagination import keyset_paginate, per_page_arg
+from config import profiles
+from pooling import build_engine_options, pool_stats
+from cache import page_cache, mark_stale
+from conditional import add_validators, not_modified, validators
+from search import highlight, search_posts
+from tag_filter import FILTER_ARGS, filter_posts, parse_tag_ids
+import feed
+import instrumentation
+import metrics
+import slowlog
+from api import api_v1
 from datetime import datetime
+import os
+
+# Loading plans for the detail pages. Each one fetches exactly the columns
+# and relationships its template touches, so rendering never lazy loads and
+# every page costs a fixed number of queries however many related rows exist.
+USER_DETAILS_PLAN = (
+    load_only(User.id, User.first_name, User.last_name, User.image_url),
+    selectinload(User.posts).load_only(Post.id, Post.title),
+)
+POST_DETAILS_PLAN = (
+    load_only(Post.id, Post.title, Post.content, Post.created_at, Post.user_id),
+    joinedload(Post.user).load_only(User.id, User.first_name, User.last_name),
+    selectinload(Post.tags).load_only(Tag.id, Tag.name),
+)
+TAG_DETAILS_PLAN = (
+    load_only(Tag.id, Tag.name),
+    selectinload(Tag.posts).load_only(Post.id, Post.title, Post.user_id),
+)
+
+
+def submitted_tag_ids():
+    """Return the set of tag ids checked on a post form.
+
+    Every id is checked against the tags table with a single IN query, and
+    the request is aborted with 400 if any of them is malformed or unknown.
+    """
+    try:
+        tag_ids = {int(tag_id) for tag_id in request.form.getlist('tags')}
+    except ValueError:
+        abort(400, 'Invalid tag id')
+
+    if tag_ids:
+        found = {tag_id for tag_id, in db.session.query(Tag.id).filter(Tag.id.in_(tag_ids))}
+        unknown = tag_ids - found
+        if unknown:
+            abort(400, f"Unknown tag ids: {', '.join(map(str, sorted(unknown)))}")
+    return tag_ids
+
+
+def add_post_tags(post_id, tag_ids):
+    """Tag a post with every id in `tag_ids` using one multi-row INSERT."""
+    if tag_ids:
+        mark_stale('tags', f"post:{post_id}", *(f"tag-posts:{tag_id}" for tag_id in tag_ids))
+        db.session.execute(
+            db.insert(PostTag.__table__).values(
+                [{'post_id': post_id, 'tag_id': tag_id} for tag_id in sorted(tag_ids)]
+            )
+        )
+        adjust_tag_post_counts(db.session, dict.fromkeys(tag_ids, 1))
+
+
+def remove_post_tags(post_id, tag_ids):
+    """Untag a post from every id in `tag_ids` using one DELETE."""
+    if tag_ids:
+        mark_stale('tags', f"post:{post_id}", *(f"tag-posts:{tag_id}" for tag_id in tag_ids))
+        db.session.query(PostTag).filter(
+            PostTag.post_id == post_id,
+            PostTag.tag_id.in_(tag_ids),
+        ).delete(synchronize_session=False)
+        adjust_tag_post_counts(db.session, dict.fromkeys(tag_ids, -1))
+
+
+def user_validator(user_id):
+    """Return the row the user page's ETag and Last-Modified derive from."""
+    return db.session.query(
+        User.updated_at, db.func.count(Post.id), db.func.max(Post.updated_at)
+    ).outerjoin(User.posts).filter(User.id == user_id).group_by(User.id, User.updated_at).first()
+
+
+def post_validator(post_id):
+    """Return the row the post page's ETag and Last-Modified derive from."""
+    return db.session.query(
+        Post.updated_at, User.updated_at, db.func.count(Tag.id), db.func.max(Tag.updated_at)
+    ).join(Post.user).outerjoin(Post.tags).filter(Post.id == post_id).group_by(
+        Post.id, Post.updated_at, User.updated_at
+    ).first()
+
+
+def tag_validator(tag_id):
+    """Return the row the tag page's ETag and Last-Modified derive from."""
+    return db.session.query(
+        Tag.updated_at, db.func.count(Post.id), db.func.max(Post.updated_at)
+    ).outerjoin(Tag.posts).filter(Tag.id == tag_id).group_by(Tag.id, Tag.updated_at).first()
+
+
+def create_app(db_url=None, testing=False, config=None, engine_options=None):
+    """Create the Blogly app.
+
+    `config` names a profile from config.py ("development", "testing" or
+    "production") and defaults to $BLOGLY_CONFIG, or "testing" when
+    `testing` is set. `db_url` overrides the profile's database and
+    `engine_options` are passed through to `create_engine`.
+    """
+    if config is None:
+        config = 'testing' if testing else os.environ.get('BLOGLY_CONFIG', 'development')
 
-def create_app(db_url='postgresql:///blogly', testing=False):
     app = Flask(__name__)
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config['SQLALCHEMY_ECHO'] = True
-    app.config['TEMPLATES_AUTO_RELOAD'] = True
-    app.config['TESTING'] = testing
-    app.config['DEBUG'] = True
-    app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-
-    if not testing:
+    app.config.from_object(profiles[config])
+    app.config.from_prefixed_env('BLOGLY')
+    if db_url is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = db_url
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **build_engine_options(app.config),
+        **(engine_options or {}),
+    }
+
+    if not app.config['SECRET_KEY']:
+        raise RuntimeError('SECRET_KEY must be set, e.g. with $BLOGLY_SECRET_KEY')
+
+    # Schema management lives in `flask blogly init-db`, so building the
+    # app never touches the database
+    if not app.testing:
         connect_db(app)
-        with app.app_context():
-            db.create_all()
-
-    from flask_debugtoolbar import DebugToolbarExtension
-    app.config['SECRET_KEY'] = "SECRET!"
-    debug = DebugToolbarExtension(app)
 
+    if app.config['DEBUG_TOOLBAR']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    instrumentation.init_app(app)
+    metrics.init_app(app)
+    slowlog.init_app(app)
+    page_cache.init_app(app)
+    feed.init_app(app)
+    app.register_blueprint(api_v1)
+    app.cli.add_command(blogly_cli)
+
+
+    @app.route('/_stats/pool')
+    def connection_pool_stats():
+        """Report live connection pool occupancy and checkout waits"""
+        return jsonify(pool_stats(db.engine.pool))
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        """Expose request, database and cache metrics to Prometheus"""
+        body = metrics.render(
+            app.extensions['metrics'],
+            pool=pool_stats(db.engine.pool),
+            recent_posts=app.extensions['recent_posts'],
+        )
+        return app.response_class(body, content_type=metrics.CONTENT_TYPE)
 
     @app.route('/')
     def home():
-        """Render homepage"""
-        return render_template('home.html')
+        """Render homepage with the newest posts from every user"""
+        after = request.args.get('after')
+        before = request.args.get('before')
+        per_page = per_page_arg(app.config['FEED_PER_PAGE'])
+
+        page = None
+        if not after and not before:
+            page = app.extensions['recent_posts'].first_page(per_page)
+        if page is None:
+            page = keyset_paginate(
+                feed.feed_query(),
+                (Post.created_at, Post.id),
+                after=after,
+                before=before,
+                per_page=per_page,
+                descending=True,
+            )
+        return render_template('home.html', page=page)
 
     @app.route('/users')
+    @page_cache.cached
     def users():
-        """Render users page"""
-        return render_template('user_listing.html', users=db.session.query(User).all())
+        """Render one page of users, ordered by name"""
+        page_cache.depends_on('users')
+        page = keyset_paginate(
+            db.session.query(User),
+            (User.last_name, User.first_name, User.id),
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            per_page=per_page_arg(app.config['USERS_PER_PAGE']),
+        )
+        return render_template('user_listing.html', users=page.items, page=page)
 
 
     @app.route('/users/new', methods=['GET', 'POST'])
@@ -57,12 +218,17 @@ def create_app(db_url='postgresql:///blogly', testing=False):
         return redirect(url_for('users'))
 
     @app.route('/users/<int:user_id>')
+    @page_cache.cached
     def user_details(user_id):
-        """Render user detail page"""  
-        return render_template(
-            'user_details.html', 
-            user = db.session.query(User).get_or_404(user_id)
-        )
+        """Render user detail page"""
+        etag, last_modified = validators(user_validator(user_id))
+        response = not_modified(etag, last_modified)
+        if response:
+            return response
+
+        user = db.session.query(User).options(*USER_DETAILS_PLAN).get_or_404(user_id)
+        page_cache.depends_on(f"user:{user.id}", f"user-posts:{user.id}")
+        return add_validators(render_template('user_details.html', user=user), etag, last_modified)
 
     @app.route('/users/<int:user_id>/edit', methods=['GET', 'POST'])
     def edit_user(user_id):
@@ -87,15 +253,54 @@ def create_app(db_url='postgresql:///blogly', testing=False):
     @app.route('/users/<int:user_id>/delete', methods=['POST'])
     def delete_user(user_id):
         """Delete user from database"""
-        user = db.session.query(User).get_or_404(user_id)
-        db.session.delete(user)
+        # One DELETE however many posts the user has; the database cascades
+        # to posts and posts_tags. The tag counts are released beforehand.
+        tag_ids = release_tag_post_counts(db.session, db.select(Post.id).where(Post.user_id == user_id))
+        deleted = db.session.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+        if not deleted:
+            abort(404)
+        mark_stale(
+            'users', 'tags', f"user:{user_id}", f"user-posts:{user_id}",
+            *(f"tag-posts:{tag_id}" for tag_id in tag_ids),
+        )
+        feed.forget_user(user_id)
         db.session.commit()
         return redirect(url_for('users'))
     
+    @app.route('/posts')
+    def posts():
+        """Render posts matching ?tags_all=, ?tags_any= and ?tags_not=, newest first"""
+        filters = {arg: request.args.get(arg) for arg in FILTER_ARGS if request.args.get(arg)}
+        query = filter_posts(
+            db.session.query(Post.id, Post.title, Post.created_at),
+            **{arg: parse_tag_ids(value) for arg, value in filters.items()}
+        )
+        page = keyset_paginate(
+            query,
+            (Post.created_at, Post.id),
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            per_page=per_page_arg(app.config['POSTS_PER_PAGE']),
+            descending=True,
+        )
+        return render_template('post_listing.html', page=page, filters=filters)
+
     @app.route('/posts/<int:post_id>')
+    @page_cache.cached
     def post_details(post_id):
         """Render post detail page"""
-        return render_template('post_details.html', post=db.session.query(Post).get_or_404(post_id))
+        etag, last_modified = validators(post_validator(post_id))
+        response = not_modified(etag, last_modified)
+        if response:
+            return response
+
+        post = db.session.query(Post).options(*POST_DETAILS_PLAN).get_or_404(post_id)
+        page_cache.depends_on(
+            f"post:{post.id}",
+            f"user:{post.user_id}",
+            *(f"tag:{tag.id}" for tag in post.tags),
+        )
+        return add_validators(render_template('post_details.html', post=post), etag, last_modified)
     
     @app.route('/users/<int:user_id>/posts/new', methods=['GET', 'POST'])
     def new_post(user_id):
@@ -112,6 +317,7 @@ def create_app(db_url='postgresql:///blogly', testing=False):
         title = request.form['title']
         content = request.form['content']
         created_at = datetime.now()
+        tag_ids = submitted_tag_ids()
 
         # Create new post instance
         new_post = Post(
@@ -121,13 +327,10 @@ def create_app(db_url='postgresql:///blogly', testing=False):
             created_at=created_at
         )
 
-        # Add tags to post
-        for tag_id in request.form.getlist('tags'):
-            tag = db.session.query(Tag).get(tag_id)
-            new_post.tags.append(tag)
-
-        # Add new post to database
+        # Add new post to database, flushing to get its id for the tags
         db.session.add(new_post)
+        db.session.flush()
+        add_post_tags(new_post.id, tag_ids)
         db.session.commit()
 
         return redirect(url_for('user_details', user_id=user_id))
@@ -143,12 +346,16 @@ def create_app(db_url='postgresql:///blogly', testing=False):
         # this is the POST request
         post.title = request.form['title']
         post.content = request.form['content']
+        # Tag changes alone would not bump it, and it feeds the page's ETag
+        post.updated_at = datetime.now()
+        tag_ids = submitted_tag_ids()
 
-        # Update tags
-        post.tags.clear()
-        for tag_id in request.form.getlist('tags'):
-            tag = db.session.query(Tag).get(tag_id)
-            post.tags.append(tag)
+        # Update tags, only touching the posts_tags rows that changed
+        current_tag_ids = {
+            tag_id for tag_id, in db.session.query(PostTag.tag_id).filter(PostTag.post_id == post_id)
+        }
+        remove_post_tags(post_id, current_tag_ids - tag_ids)
+        add_post_tags(post_id, tag_ids - current_tag_ids)
 
         # Update post in database
         db.session.add(post)
@@ -159,20 +366,97 @@ def create_app(db_url='postgresql:///blogly', testing=False):
     @app.route('/posts/<int:post_id>/delete', methods=['POST'])
     def delete_post(post_id):
         """Delete post from database"""
-        post = db.session.query(Post).get_or_404(post_id)
-        db.session.delete(post)
+        # A single DELETE; the database cascades to posts_tags, so the
+        # post's tags are never loaded. Their counts are released beforehand.
+        tag_ids = release_tag_post_counts(db.session, [post_id])
+        user_id = db.session.execute(
+            db.delete(Post).where(Post.id == post_id).returning(Post.user_id),
+            execution_options={'synchronize_session': False},
+        ).scalar()
+        if user_id is None:
+            abort(404)
+        mark_stale(
+            'tags', f"post:{post_id}", f"user-posts:{user_id}", *(f"tag-posts:{tag_id}" for tag_id in tag_ids)
+        )
+        feed.forget_post(post_id)
         db.session.commit()
-        return redirect(url_for('user_details', user_id=post.user_id))
+        return redirect(url_for('user_details', user_id=user_id))
     
+    @app.route('/search')
+    def search():
+        """Render full-text search results for ?q="""
+        q = request.args.get('q', '').strip()
+        page = None
+        if q:
+            page = search_posts(
+                q,
+                after=request.args.get('after'),
+                before=request.args.get('before'),
+                per_page=per_page_arg(app.config['SEARCH_PER_PAGE']),
+            )
+        return render_template('search.html', q=q, page=page, highlight=highlight)
+
+    @app.route('/api/search')
+    def api_search():
+        """Return full-text search results for ?q= as JSON"""
+        q = request.args.get('q', '').strip()
+        if not q:
+            abort(400, 'Missing search query')
+        page = search_posts(
+            q,
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            per_page=per_page_arg(app.config['SEARCH_PER_PAGE']),
+        )
+        return jsonify({
+            'results': [
+                {
+                    'id': row.id,
+                    'title': row.title,
+                    'created_at': row.created_at.isoformat(),
+                    'user_id': row.user_id,
+                    'rank': row.rank,
+                    'snippet': str(highlight(row.snippet)),
+                }
+                for row in page
+            ],
+            'next': page.next_cursor,
+            'prev': page.prev_cursor,
+        })
+
     @app.route('/tags')
+    @page_cache.cached
     def tags():
-        """Render tags page"""
-        return render_template('tag_listing.html', tags=db.session.query(Tag).all())
+        """Render tags page, most used first"""
+        page_cache.depends_on('tags')
+        if app.config['TAG_POST_COUNTS'] == 'denormalized':
+            post_count = Tag.post_count
+            query = db.session.query(Tag.id, Tag.name, post_count)
+        else:
+            # Counted straight off the posts_tags(tag_id, post_id) index
+            post_count = db.func.count(PostTag.post_id).label('post_count')
+            query = db.session.query(Tag.id, Tag.name, post_count).outerjoin(
+                PostTag, PostTag.tag_id == Tag.id
+            ).group_by(Tag.id, Tag.name)
+        return render_template(
+            'tag_listing.html',
+            tags=query.order_by(post_count.desc(), Tag.name).all()
+        )
 
     @app.route('/tags/<int:tag_id>')
+    @page_cache.cached
     def tag_details(tag_id):
         """Render tag detail page"""
-        return render_template('tag_details.html', tag=db.session.query(Tag).get_or_404(tag_id))
+        etag, last_modified = validators(tag_validator(tag_id))
+        response = not_modified(etag, last_modified)
+        if response:
+            return response
+
+        tag = db.session.query(Tag).options(*TAG_DETAILS_PLAN).get_or_404(tag_id)
+        # A fixed set however many posts the tag has; retitling or deleting a
+        # post marks the tag-posts of its tags, see cache._row_deps
+        page_cache.depends_on(f"tag:{tag.id}", f"tag-posts:{tag.id}")
+        return add_validators(render_template('tag_details.html', tag=tag), etag, last_modified)
 
     @app.route('/tags/new', methods=['GET', 'POST'])
     def new_tag():
@@ -211,8 +495,13 @@ def create_app(db_url='postgresql:///blogly', testing=False):
 
     @app.route('/tags/<int:tag_id>/delete', methods=['POST'])
     def delete_tag(tag_id):
-        tag = db.session.query(Tag).get_or_404(tag_id)
-        db.session.delete(tag)
+        """Delete tag from database"""
+        # A single DELETE; the database cascades to posts_tags, so the
+        # tag's posts are never loaded
+        deleted = db.session.query(Tag).filter(Tag.id == tag_id).delete(synchronize_session=False)
+        if not deleted:
+            abort(404)
+        mark_stale('tags', f"tag:{tag_id}", f"tag-posts:{tag_id}")
         db.session.commit()
 
         return redirect(url_for('tags'))
@@ -223,4 +512,4 @@ def create_app(db_url='postgresql:///blogly', testing=False):
 
 if __name__ == '__main__':
     app = create_app()
-    app.run(debug=True)
+    app.run()
@@ -0,0 +1,93 @@
+"""Per-request overhead of the development profile versus production.
+
+Builds the app under both profiles against the same SQLite database, seeds
+it, and times a mix of read routes through the test client. The difference
+is what SQL echo, template reloading and the debug toolbar cost on every
+request. The page cache and the feed buffer are off under both profiles, so
+every request renders rather than production's being mostly cache hits.
+
+    python benchmarks/bench_profiles.py [--requests N]
+"""
+
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app
+from models import db, User, Post, Tag
+
+ROUTES = ['/users', '/users/1', '/posts/1', '/tags', '/tags/1']
+
+
+def seed(app):
+    with app.app_context():
+        db.create_all()
+        user = User(first_name='Bench', last_name='User', image_url='https://www.example.com')
+        tags = [Tag(name=f"tag{i}") for i in range(10)]
+        db.session.add(user)
+        db.session.add_all(tags)
+        db.session.flush()
+        for i in range(50):
+            db.session.add(Post(
+                title=f"Post {i}",
+                content=f"Content of post {i}",
+                user_id=user.id,
+                created_at=datetime.now(),
+                tags=tags[:i % 10],
+            ))
+        db.session.commit()
+
+
+def time_requests(app, requests):
+    client = app.test_client()
+    for url in ROUTES:
+        client.get(url)
+
+    timings = []
+    for i in range(requests):
+        url = ROUTES[i % len(ROUTES)]
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, (url, response.status_code)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ.setdefault('BLOGLY_SECRET_KEY', 'bench')
+    os.environ['BLOGLY_PAGE_CACHE_BACKEND'] = 'null'
+    os.environ['BLOGLY_FEED_BUFFER_SIZE'] = '0'
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        results = {}
+        # SQL echo writes to stdout; keep it off the report
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for profile in ('development', 'production'):
+                app = create_app(db_url=db_url, config=profile)
+                if profile == 'development':
+                    seed(app)
+                results[profile] = time_requests(app, args.requests)
+                with app.app_context():
+                    db.engine.dispose()
+
+    for profile, timings in results.items():
+        print(f"{profile:12} mean {statistics.mean(timings) * 1000:7.3f} ms  "
+              f"p50 {statistics.median(timings) * 1000:7.3f} ms  "
+              f"p99 {statistics.quantiles(timings, n=100)[98] * 1000:7.3f} ms")
+    saved = statistics.mean(results['development']) - statistics.mean(results['production'])
+    print(f"overhead removed per request: {saved * 1000:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""Latency, queries and response size of every read route.
+
+Run against a database filled by datagen.py. Every GET route registered in
+`create_app` is requested with ids sampled from the data, and the results
+are written as JSON so runs at different scales, or before and after a
+change, can be compared:
+
+    python benchmarks/bench_routes.py --db postgresql:///blogly_bench -o after.json
+    python benchmarks/bench_routes.py --db postgresql:///blogly_bench --compare before.json
+
+The page cache and the home page's feed buffer are off unless --cache is
+given, so the numbers are those of a cold render. Routes that only take
+POST, the forms that add, edit and delete rows, are deliberately left out:
+each request would change the data the next one reads.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import url_for
+from sqlalchemy import event, func
+
+from app import create_app
+from models import db, User, Post, Tag
+
+# Query strings needed for a route to do real work
+ROUTE_ARGS = {
+    'search': {'q': 'python'},
+    'api_search': {'q': 'python'},
+    'api_v1.export': {'table': 'tags'},
+}
+# Not read routes, or not the app's
+SKIP = {'static', 'connection_pool_stats', 'debugtoolbar'}
+
+
+def sample_ids(model, count, rng):
+    """Pick ids spread over the whole table, including both ends."""
+    low, high = db.session.query(func.min(model.id), func.max(model.id)).one()
+    if low is None:
+        return []
+    return sorted({low, high, *(rng.randint(low, high) for _ in range(count))})
+
+
+def build_urls(app, samples, count, rng):
+    """Return `{endpoint: (rule, [url, ...])}` for every GET route."""
+    urls = {}
+    with app.test_request_context():
+        for rule in app.url_map.iter_rules():
+            if 'GET' not in rule.methods or rule.endpoint.split('.')[0] in SKIP:
+                continue
+            args = dict(ROUTE_ARGS.get(rule.endpoint, {}))
+            ids = [name for name in rule.arguments if name.endswith('_id')]
+            if set(rule.arguments) - set(ids) - set(args):
+                continue
+            if ids:
+                routes = [
+                    url_for(rule.endpoint, **args, **{name: rng.choice(samples[name]) for name in ids})
+                    for _ in range(count)
+                ]
+            else:
+                routes = [url_for(rule.endpoint, **args)]
+            urls[rule.endpoint] = (rule.rule, routes)
+    return urls
+
+
+def summarize(values, scale=1):
+    values = sorted(value * scale for value in values)
+    percentiles = statistics.quantiles(values, n=100, method='inclusive') if len(values) > 1 else values * 99
+    return {
+        'mean': round(statistics.mean(values), 3),
+        'p50': round(percentiles[49], 3),
+        'p90': round(percentiles[89], 3),
+        'p99': round(percentiles[98], 3),
+        'max': round(values[-1], 3),
+    }
+
+
+def run(app, urls, requests):
+    client = app.test_client()
+    queries = [0]
+
+    def count(*args):
+        queries[0] += 1
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        results = {}
+        for endpoint, (rule, routes) in sorted(urls.items()):
+            # Warm up templates and connections
+            client.get(routes[0])
+            latencies, counts, sizes, statuses = [], [], [], {}
+            for i in range(requests):
+                queries[0] = 0
+                start = time.perf_counter()
+                response = client.get(routes[i % len(routes)])
+                body = response.get_data()
+                latencies.append(time.perf_counter() - start)
+                counts.append(queries[0])
+                sizes.append(len(body))
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            results[endpoint] = {
+                'rule': rule,
+                'requests': requests,
+                'latency_ms': summarize(latencies, 1000),
+                'queries': summarize(counts),
+                'bytes': summarize(sizes),
+                'statuses': {str(status): n for status, n in sorted(statuses.items())},
+            }
+        return results
+    finally:
+        with app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+
+def compare(baseline, results):
+    print(f"{'endpoint':28} {'p50 ms':>18} {'queries':>14} {'bytes':>20}")
+    for endpoint, result in results['routes'].items():
+        before = baseline['routes'].get(endpoint)
+        if before is None:
+            continue
+        print(f"{endpoint:28} "
+              f"{before['latency_ms']['p50']:8.2f} -> {result['latency_ms']['p50']:8.2f} "
+              f"{before['queries']['mean']:6.1f} -> {result['queries']['mean']:6.1f} "
+              f"{before['bytes']['mean']:9.0f} -> {result['bytes']['mean']:9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='Database filled by datagen.py.')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route.')
+    parser.add_argument('--samples', type=int, default=50, help='Distinct ids per route.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache', action='store_true', help='Keep the page cache and feed buffer on.')
+    parser.add_argument('--output', '-o', help='Write the results here as JSON.')
+    parser.add_argument('--compare', help='Print the change from an earlier results file.')
+    args = parser.parse_args()
+
+    os.environ.setdefault('BLOGLY_SECRET_KEY', 'bench')
+    if not args.cache:
+        os.environ['BLOGLY_PAGE_CACHE_BACKEND'] = 'null'
+        # Too small for any page, so the home feed is read from the database
+        os.environ['BLOGLY_FEED_BUFFER_SIZE'] = '0'
+    app = create_app(db_url=args.db, config='production')
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        samples = {
+            'user_id': sample_ids(User, args.samples, rng),
+            'post_id': sample_ids(Post, args.samples, rng),
+            'tag_id': sample_ids(Tag, args.samples, rng),
+        }
+        rows = {
+            'users': db.session.query(func.count(User.id)).scalar(),
+            'posts': db.session.query(func.count(Post.id)).scalar(),
+            'tags': db.session.query(func.count(Tag.id)).scalar(),
+        }
+        dialect = db.engine.dialect.name
+        db.session.remove()
+    if not all(samples.values()):
+        parser.error('The database is empty; fill it with datagen.py first')
+
+    results = {
+        'meta': {
+            'started_at': datetime.now().isoformat(),
+            'dialect': dialect,
+            'rows': rows,
+            'requests': args.requests,
+            'cache': args.cache,
+            'python': platform.python_version(),
+        },
+        'routes': run(app, build_urls(app, samples, args.samples, rng), args.requests),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    else:
+        for endpoint, result in results['routes'].items():
+            print(f"{endpoint:28} p50 {result['latency_ms']['p50']:8.2f} ms  "
+                  f"p99 {result['latency_ms']['p99']:8.2f} ms  "
+                  f"{result['queries']['mean']:5.1f} queries  {result['bytes']['mean']:9.0f} bytes")
+
+
+if __name__ == '__main__':
+    main()
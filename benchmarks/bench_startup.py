@@ -0,0 +1,67 @@
+"""Cold-start cost of a Blogly worker.
+
+Reports how long a fresh interpreter takes to import the app module, and
+how long `create_app()` takes once it is imported. Neither should touch the
+database, so both numbers stay flat as the schema and data grow.
+
+    python benchmarks/bench_startup.py [--runs N] [--config PROFILE]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import app
+print(time.perf_counter() - start)
+"""
+
+
+def time_import(runs):
+    timings = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', IMPORT_SNIPPET],
+            cwd=ROOT, check=True, capture_output=True, text=True,
+        ).stdout
+        timings.append(float(out.strip().splitlines()[-1]))
+    return timings
+
+
+def time_create_app(runs, config):
+    from app import create_app
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        create_app(config=config)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    print(f"{name:12} mean {statistics.mean(timings) * 1000:8.3f} ms  "
+          f"min {min(timings) * 1000:8.3f} ms  max {max(timings) * 1000:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--config', default='production')
+    args = parser.parse_args()
+
+    os.environ.setdefault('BLOGLY_SECRET_KEY', 'bench')
+    report('import app', time_import(args.runs))
+    report('create_app', time_create_app(args.runs, args.config))
+
+
+if __name__ == '__main__':
+    main()
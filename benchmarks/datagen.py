@@ -0,0 +1,141 @@
+"""Synthetic Blogly data at benchmark scale.
+
+Fills a database with users, posts and tags whose shape resembles a real
+blog: both posts per user and tag popularity follow a Zipf distribution, so
+a few users and tags are huge and most are small. The same --seed always
+produces the same data. Rows are written through bulk_import, so COPY on
+Postgres and multi-row INSERTs elsewhere.
+
+    python benchmarks/datagen.py --db postgresql:///blogly_bench --posts 1000000
+"""
+
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app
+from bulk_import import Importer
+from cli import recount_tag_post_counts
+from models import db
+
+WORDS = (
+    'alpha bravo coffee delta engine flask garden harbor island jungle kettle lemon mountain '
+    'network orange python quartz river sunset tiger umbrella violet winter yellow zebra'
+).split()
+START = datetime(2020, 1, 1)
+
+
+class Zipf:
+    """Draws ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** s."""
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (rank + 1) ** s for rank in range(n)))
+        self.total = self.cumulative[-1]
+
+    def draw(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.total)
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def generate_users(count, rng):
+    for i in range(1, count + 1):
+        yield {
+            'id': i,
+            'first_name': rng.choice(WORDS).title(),
+            'last_name': f"{rng.choice(WORDS).title()}{i}",
+            'image_url': f"https://www.example.com/{i}.png",
+        }
+
+
+def generate_tags(count):
+    for i in range(1, count + 1):
+        yield {'id': i, 'name': f"{WORDS[i % len(WORDS)]}-{i}"}
+
+
+def generate_posts(count, users, rng, zipf_s):
+    # Shuffle so the prolific users are not simply the lowest ids
+    authors = list(range(1, users + 1))
+    rng.shuffle(authors)
+    popularity = Zipf(users, zipf_s, rng)
+    seconds = 5 * 365 * 24 * 3600
+    for i in range(1, count + 1):
+        yield {
+            'id': i,
+            'title': sentence(rng, 4)[:50],
+            'content': sentence(rng, 25)[:200],
+            'created_at': START + timedelta(seconds=i * seconds // count),
+            'user_id': authors[popularity.draw()],
+        }
+
+
+def generate_post_tags(posts, tags, rng, zipf_s, max_tags):
+    popularity = Zipf(tags, zipf_s, rng)
+    for post_id in range(1, posts + 1):
+        for tag_rank in sorted({popularity.draw() for _ in range(rng.randint(0, max_tags))}):
+            yield {'post_id': post_id, 'tag_id': tag_rank + 1}
+
+
+def load(name, rows, batch_size):
+    importer = Importer(name)
+    start = time.perf_counter()
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            importer.load(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        importer.load(batch)
+        total += len(batch)
+    importer.reset_sequence()
+    print(f"{name:10} {total:>10} rows in {time.perf_counter() - start:7.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='Database URL to fill.')
+    parser.add_argument('--posts', type=int, default=10_000)
+    parser.add_argument('--users', type=int, default=None, help='Defaults to one per 20 posts.')
+    parser.add_argument('--tags', type=int, default=None, help='Defaults to one per 100 posts.')
+    parser.add_argument('--max-tags', type=int, default=5, help='Most tags on one post.')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent for users and tags.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--drop', action='store_true', help='Drop and recreate the tables first.')
+    args = parser.parse_args()
+
+    users = args.users or max(1, args.posts // 20)
+    tags = args.tags or max(1, args.posts // 100)
+    rng = random.Random(args.seed)
+
+    os.environ.setdefault('BLOGLY_SECRET_KEY', 'bench')
+    app = create_app(db_url=args.db, config='production')
+    with app.app_context():
+        if args.drop:
+            db.drop_all()
+        db.create_all()
+        load('users', generate_users(users, rng), args.batch_size)
+        load('tags', generate_tags(tags), args.batch_size)
+        load('posts', generate_posts(args.posts, users, rng, args.zipf), args.batch_size)
+        load('post_tags', generate_post_tags(args.posts, tags, rng, args.zipf, args.max_tags), args.batch_size)
+        recount_tag_post_counts()
+        if db.engine.dialect.name == 'postgresql':
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                conn.exec_driver_sql('VACUUM ANALYZE')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Bulk loading of Blogly's tables from NDJSON or CSV.
+
+Files use the layout written by export.py: one object or CSV row per table
+row, keyed by column name. Rows are written in batches, each in its own
+transaction: with COPY on Postgres and multi-row INSERTs elsewhere. Columns
+left out of the file get their model defaults, and post_tags rows may name
+their tag with "tag" instead of giving a "tag_id"; those names are resolved
+a batch at a time, creating the tags that do not exist yet.
+
+Every batch also records the number of rows loaded so far in the
+import_checkpoints table, in the batch's own transaction, so an interrupted
+import picks up exactly where it stopped.
+"""
+
+import csv
+import io
+import itertools
+import json
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from export import TABLES
+from models import db, ImportCheckpoint, Tag
+
+# SQLite's limit on bound parameters in one statement
+MAX_BIND_PARAMS = 32766
+
+
+def read_rows(path, format):
+    """Yield each row of an NDJSON or CSV file as a dict."""
+    with open(path, newline='') as f:
+        if format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+def _coerce(column, value):
+    """Turn a value read from a file into what `column` stores."""
+    if value is None or (value == '' and not isinstance(column.type, db.String)):
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if python_type is int and isinstance(value, str):
+        return int(value)
+    return value
+
+
+def _default(column):
+    if column.default is None:
+        return None
+    if column.default.is_callable:
+        return column.default.arg(None)
+    return column.default.arg
+
+
+class Checkpoint:
+    """How many rows of a file have been loaded, kept in import_checkpoints.
+
+    `save` runs on the batch's connection, so the count commits or rolls
+    back together with the rows it counts.
+    """
+
+    table = ImportCheckpoint.__table__
+
+    def __init__(self, name, engine=None):
+        self.name = name
+        self.engine = engine or db.engine
+
+    def _begin(self):
+        # Databases created before the table existed
+        with self.engine.begin() as conn:
+            self.table.create(conn, checkfirst=True)
+        return self.engine.begin()
+
+    def load(self):
+        with self._begin() as conn:
+            rows = conn.execute(select(self.table.c.rows).where(self.table.c.name == self.name)).scalar()
+        return rows or 0
+
+    def save(self, conn, rows):
+        updated = conn.execute(
+            self.table.update().where(self.table.c.name == self.name).values(rows=rows)
+        ).rowcount
+        if not updated:
+            conn.execute(self.table.insert().values(name=self.name, rows=rows))
+
+    def clear(self):
+        with self._begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.name == self.name))
+
+
+class Importer:
+    """Loads batches of rows into one table."""
+
+    def __init__(self, name, engine=None):
+        self.table = TABLES[name]
+        self.engine = engine or db.engine
+        self.postgres = self.engine.dialect.name == 'postgresql'
+        self._tag_ids = {}
+
+    def prepare(self, conn, batch):
+        """Return the batch as complete rows of coerced column values."""
+        columns = self.table.columns
+        if self.table.name == 'posts_tags':
+            for row in batch:
+                if row.get('tag_id') in (None, '') and row.get('tag') in (None, ''):
+                    raise ValueError(f"post_tags row has neither a tag nor a tag_id: {json.dumps(row)}")
+            self.resolve_tags(conn, {row['tag'] for row in batch if row.get('tag_id') in (None, '')})
+
+        rows = []
+        for row in batch:
+            row = dict(row)
+            if self.table.name == 'posts_tags' and row.get('tag_id') in (None, ''):
+                row['tag_id'] = self._tag_ids[row.pop('tag')]
+            row.pop('tag', None)
+            rows.append(row)
+
+        present = set().union(*rows)
+        unknown = present - set(columns.keys())
+        if unknown:
+            raise ValueError(f"Unknown {self.table.name} columns: {', '.join(sorted(unknown))}")
+        # Every row needs the same columns for one multi-row statement
+        columns = [column for column in columns if column.name in present or column.default is not None]
+        return [
+            {
+                column.name: _coerce(column, row[column.name]) if column.name in row else _default(column)
+                for column in columns
+            }
+            for row in rows
+        ]
+
+    def resolve_tags(self, conn, names):
+        """Look up, or create, the ids of every tag in `names` not seen yet."""
+        names = names - self._tag_ids.keys()
+        if not names:
+            return
+        tags = Tag.__table__
+        missing = names - self._lookup_tags(conn, names)
+        if missing:
+            now = datetime.now()
+            conn.execute(tags.insert().values([
+                {'name': name, 'post_count': 0, 'updated_at': now} for name in sorted(missing)
+            ]))
+            self._lookup_tags(conn, missing)
+
+    def _lookup_tags(self, conn, names):
+        tags = Tag.__table__
+        found = conn.execute(select(tags.c.name, tags.c.id).where(tags.c.name.in_(names))).all()
+        self._tag_ids.update(found)
+        return {name for name, _ in found}
+
+    def load(self, batch, checkpoint=None, done=0):
+        """Write one batch in its own transaction, recording `done` rows in `checkpoint`."""
+        with self.engine.begin() as conn:
+            rows = self.prepare(conn, batch)
+            if self.postgres:
+                self._copy(conn, rows)
+            else:
+                for chunk in batched(rows, max(1, MAX_BIND_PARAMS // len(rows[0]))):
+                    conn.execute(self.table.insert().values(chunk))
+            if checkpoint:
+                checkpoint.save(conn, done)
+
+    def _copy(self, conn, rows):
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(row[column] for column in columns)
+        buffer.seek(0)
+
+        names = ', '.join(f'"{column}"' for column in columns)
+        # An empty, unquoted CSV field is NULL to COPY; keep it '' for text
+        strings = [c for c in columns if isinstance(self.table.c[c].type, db.String)]
+        options = 'FORMAT csv'
+        if strings:
+            options += ', FORCE_NOT_NULL ({})'.format(', '.join(f'"{c}"' for c in strings))
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(f'COPY "{self.table.name}" ({names}) FROM STDIN WITH ({options})', buffer)
+        finally:
+            cursor.close()
+
+    def reset_sequence(self):
+        """Move the id sequence past ids loaded explicitly, on Postgres."""
+        if not self.postgres or 'id' not in self.table.c:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(select(func.setval(
+                func.pg_get_serial_sequence(self.table.name, 'id'),
+                select(func.coalesce(func.max(self.table.c.id), 0) + 1).scalar_subquery(),
+                False,
+            )))
+
+
+def import_file(name, path, format, batch_size=1000, checkpoint=None, progress=None):
+    """Load `path` into table `name`, resuming after `checkpoint` rows.
+
+    Returns the total number of rows loaded from the file. `progress` is
+    called with that running total after every batch.
+    """
+    importer = Importer(name)
+    done = checkpoint.load() if checkpoint else 0
+    for batch in batched(itertools.islice(read_rows(path, format), done, None), batch_size):
+        done += len(batch)
+        importer.load(batch, checkpoint, done)
+        if progress:
+            progress(done)
+    importer.reset_sequence()
+    return done
@@ -0,0 +1,410 @@
+"""Rendered-page cache for Blogly's read routes.
+
+Every cached page is tagged with the rows it was built from, e.g.
+"post:3" or "tag-posts:2". When a session commits, the rows it touched are
+turned into the same tags and every page carrying one of them is evicted,
+so a cached page is never served after the data behind it changed.
+
+Tags used by the app:
+
+    users            the user listing
+    user:<id>        a user's name and picture, or the user existing at all
+    user-posts:<id>  which posts a user has
+    post:<id>        a post's title, content and tags
+    tags             the tag listing, including its post counts
+    tag:<id>         a tag's name
+    tag-posts:<id>   which posts carry a tag, and their titles
+
+Commits only evict pages from the committing process's cache, and bulk
+writes such as `flask blogly import` from none, so every entry also expires
+PAGE_CACHE_TTL seconds after it was stored. That bounds how long another
+worker keeps serving a page, and its ETag, after the data changed.
+"""
+
+import fcntl
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, make_response, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import db, User, Post, Tag, PostTag
+
+STALE_KEY = 'page_cache_stale'
+
+
+class LRUBackend:
+    """In-process cache bounded by entry count, total body size and age."""
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._deps = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[3] is not None and time.monotonic() >= entry[3]:
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, deps, generation):
+        size = len(value[0])
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            # Something this page was built from changed while it rendered
+            if generation != self.generation:
+                return
+            self._discard(key)
+            self._entries[key] = (value, frozenset(deps), size, expires)
+            self._size += size
+            for dep in deps:
+                self._deps.setdefault(dep, set()).add(key)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, deps):
+        with self._lock:
+            self.generation += 1
+            for dep in deps:
+                for key in self._deps.pop(dep, ()):
+                    self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._deps.clear()
+            self._size = 0
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        value, deps, size, expires = entry
+        self._size -= size
+        for dep in deps:
+            keys = self._deps.get(dep)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._deps[dep]
+
+
+class FileSystemBackend:
+    """Cache shared by every worker on a host through a directory.
+
+    Pages live in entries/, and deps/<tag>/ holds one marker file per page
+    carrying that tag, so invalidation only has to list the tag's directory.
+    An entry file is a JSON header line (status, headers, tags, expiry)
+    followed by the raw body. Writers and invalidations take an flock on
+    the directory's lock file, so a page rendered before an invalidation
+    can never be stored after it.
+    """
+
+    def __init__(self, directory, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = os.path.join(directory, 'entries')
+        self._deps = os.path.join(directory, 'deps')
+        self._generation = os.path.join(directory, 'generation')
+        self._lock_path = os.path.join(directory, 'lock')
+        _private_directory(directory)
+        os.makedirs(self._entries, mode=0o700, exist_ok=True)
+        os.makedirs(self._deps, mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def _name(value):
+        return hashlib.sha1(value.encode()).hexdigest()
+
+    @property
+    def generation(self):
+        try:
+            with open(self._generation) as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def get(self, key):
+        entry = self._read(os.path.join(self._entries, self._name(key)))
+        if entry is None:
+            return None
+        header, body = entry
+        if header['expires'] is not None and time.time() >= header['expires']:
+            return None
+        return body, header['status'], [tuple(item) for item in header['headers']]
+
+    def set(self, key, value, deps, generation):
+        body, status, headers = value
+        if len(body) > self.max_bytes:
+            return
+        header = {
+            'status': status,
+            'headers': headers,
+            'deps': sorted(deps),
+            'expires': time.time() + self.ttl if self.ttl is not None else None,
+        }
+        data = json.dumps(header).encode() + b'\n' + body
+        name = self._name(key)
+        with self._locked():
+            # Something this page was built from changed while it rendered
+            if generation != self.generation:
+                return
+            self._prune(len(data))
+            for dep in deps:
+                dep_dir = os.path.join(self._deps, self._name(dep))
+                os.makedirs(dep_dir, mode=0o700, exist_ok=True)
+                open(os.path.join(dep_dir, name), 'w').close()
+            self._write(os.path.join(self._entries, name), data)
+
+    def invalidate(self, deps):
+        with self._locked():
+            self._write(self._generation, str(self.generation + 1).encode())
+            for dep in deps:
+                dep_dir = os.path.join(self._deps, self._name(dep))
+                try:
+                    names = os.listdir(dep_dir)
+                except FileNotFoundError:
+                    continue
+                for name in names:
+                    self._remove(os.path.join(self._entries, name))
+                shutil.rmtree(dep_dir, ignore_errors=True)
+
+    def clear(self):
+        with self._locked():
+            self._write(self._generation, str(self.generation + 1).encode())
+            shutil.rmtree(self._entries, ignore_errors=True)
+            shutil.rmtree(self._deps, ignore_errors=True)
+            os.makedirs(self._entries, mode=0o700, exist_ok=True)
+            os.makedirs(self._deps, mode=0o700, exist_ok=True)
+
+    def _prune(self, incoming):
+        """Drop expired entries, then the oldest, until `incoming` bytes fit."""
+        entries = []
+        with os.scandir(self._entries) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        now = time.time()
+        count = len(entries)
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for mtime, entry_size, path in entries:
+            over = count >= self.max_entries or size + incoming > self.max_bytes
+            # Entries are written with the same ttl, so the oldest expire first
+            expired = self.ttl is not None and mtime + self.ttl <= now
+            if not (over or expired):
+                break
+            self._evict(path)
+            count -= 1
+            size -= entry_size
+
+    def _evict(self, path):
+        entry = self._read(path)
+        self._remove(path)
+        if entry is not None:
+            name = os.path.basename(path)
+            for dep in entry[0]['deps']:
+                self._remove(os.path.join(self._deps, self._name(dep), name))
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'rb') as f:
+                header, body = f.read().split(b'\n', 1)
+            return json.loads(header), body
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def _locked(self):
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _write(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+def _private_directory(directory):
+    """Create `directory` for this user only, refusing one anyone else can reach."""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    stat = os.lstat(directory)
+    if not os.path.isdir(directory) or os.path.islink(directory):
+        raise PermissionError(f"Page cache directory {directory} is not a directory")
+    if stat.st_uid != os.getuid():
+        raise PermissionError(f"Page cache directory {directory} is owned by another user")
+    if stat.st_mode & 0o077:
+        raise PermissionError(f"Page cache directory {directory} is accessible to other users")
+
+
+def create_backend(config):
+    """Build the backend named by PAGE_CACHE_BACKEND, or None to disable caching."""
+    backend = config['PAGE_CACHE_BACKEND']
+    limits = (config['PAGE_CACHE_MAX_ENTRIES'], config['PAGE_CACHE_MAX_BYTES'], config['PAGE_CACHE_TTL'])
+    if backend == 'lru':
+        return LRUBackend(*limits)
+    if backend == 'filesystem':
+        directory = config['PAGE_CACHE_DIR'] or os.path.join(
+            tempfile.gettempdir(), f"blogly-page-cache-{os.getuid()}"
+        )
+        return FileSystemBackend(directory, *limits)
+    if backend in (None, 'null'):
+        return None
+    raise ValueError(f"Unknown PAGE_CACHE_BACKEND {backend!r}")
+
+
+class PageCache:
+    """Flask extension caching the rendered responses of read-only views."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['page_cache'] = create_backend(app.config)
+
+    @property
+    def backend(self):
+        return current_app.extensions.get('page_cache')
+
+    def cached(self, view):
+        """Serve `view` from the cache, keyed by request path and query string.
+
+        Only 200 responses are stored, and only with the tags the view
+        declared through `depends_on`.
+        """
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            backend = self.backend
+            if backend is None or request.method != 'GET':
+                return view(*args, **kwargs)
+
+            key = request.full_path
+            value = backend.get(key)
+            if value is not None:
+                g.page_cache_result = 'hit'
+                body, status, headers = value
+                response = current_app.response_class(body, status=status, headers=headers)
+                return response.make_conditional(request)
+
+            generation = backend.generation
+            g.page_cache_result = 'miss'
+            g.page_cache_deps = set()
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and g.page_cache_deps:
+                value = (response.get_data(), response.status_code, list(response.headers))
+                backend.set(key, value, g.page_cache_deps, generation)
+            return response
+        return wrapper
+
+    def depends_on(self, *deps):
+        """Tag the page being rendered with the rows it was built from."""
+        if 'page_cache_deps' in g:
+            g.page_cache_deps.update(deps)
+
+
+def mark_stale(*deps):
+    """Evict pages tagged with `deps` once the current transaction commits.
+
+    Needed after bulk statements that bypass the ORM unit of work, which the
+    session events below cannot see.
+    """
+    db.session.info.setdefault(STALE_KEY, set()).update(deps)
+
+
+def _row_deps(session, obj):
+    """Return the cache tags touched by adding, changing or deleting `obj`."""
+    if isinstance(obj, User):
+        return {'users', f"user:{obj.id}"}
+    if isinstance(obj, Post):
+        deps = {f"post:{obj.id}", f"user-posts:{obj.user_id}"}
+        state = inspect(obj)
+        history = state.attrs.tags.history
+        if history.added or history.deleted:
+            deps.add('tags')
+            deps.update(f"tag-posts:{tag.id}" for tag in (*history.added, *history.deleted))
+        if state.deleted or state.attrs.title.history.has_changes():
+            # Tag pages list their posts' titles
+            deps.update(f"tag-posts:{tag_id}" for tag_id in _post_tag_ids(session, obj))
+        return deps
+    if isinstance(obj, Tag):
+        deps = {'tags', f"tag:{obj.id}"}
+        history = inspect(obj).attrs.posts.history
+        deps.update(f"post:{post.id}" for post in (*history.added, *history.deleted))
+        return deps
+    if isinstance(obj, PostTag):
+        return {'tags', f"post:{obj.post_id}", f"tag-posts:{obj.tag_id}"}
+    return set()
+
+
+def _post_tag_ids(session, post):
+    if 'tags' in inspect(post).dict:
+        return [tag.id for tag in post.tags]
+    posts_tags = PostTag.__table__
+    return session.connection().execute(
+        db.select(posts_tags.c.tag_id).where(posts_tags.c.post_id == post.id)
+    ).scalars().all()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_stale(session, flush_context):
+    stale = session.info.setdefault(STALE_KEY, set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        stale.update(_row_deps(session, obj))
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_stale(session):
+    stale = session.info.pop(STALE_KEY, None)
+    if stale and has_app_context():
+        backend = current_app.extensions.get('page_cache')
+        if backend is not None:
+            backend.invalidate(stale)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_stale(session):
+    session.info.pop(STALE_KEY, None)
+
+
+page_cache = PageCache()
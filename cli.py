@@ -0,0 +1,233 @@
+"""Command line tools for Blogly, available as `flask blogly ...`."""
+
+import os
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import inspect
+from sqlalchemy.schema import AddConstraint, CreateColumn, CreateIndex
+
+from bulk_import import Checkpoint, import_file
+from export import FORMATS, TABLES, export_rows
+from models import db, User, Post, Tag, PostTag, POSTGRES_SEARCH_DDL, RETIRED_INDEXES, SQLITE_SEARCH_DDL
+
+blogly_cli = AppGroup('blogly', help='Blogly maintenance commands.')
+
+
+@blogly_cli.command('init-db')
+@click.option('--drop', is_flag=True, help='Drop all existing tables first.')
+def init_db(drop):
+    """Create the database tables and their indexes."""
+    if drop:
+        db.drop_all()
+    db.create_all()
+    click.echo("Initialized the database.")
+
+
+@blogly_cli.command('create-indexes')
+def create_indexes():
+    """Build any missing indexes on an existing database.
+
+    On Postgres the indexes are built with CREATE INDEX CONCURRENTLY, so
+    reads and writes keep flowing while they build. Invalid leftovers of an
+    interrupted concurrent build are dropped and rebuilt. Indexes listed in
+    RETIRED_INDEXES are dropped once their replacements exist; an index
+    whose definition changes gets a new name so it is built here.
+    """
+    engine = db.engine
+    postgres = engine.dialect.name == 'postgresql'
+    indexes = [index for table in db.metadata.sorted_tables for index in sorted(table.indexes, key=lambda i: i.name)]
+
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if postgres:
+            invalid = set(conn.exec_driver_sql(
+                "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE NOT i.indisvalid"
+            ).scalars())
+            for index in indexes:
+                if index.name in invalid:
+                    click.echo(f"Dropping invalid index {index.name}")
+                    conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"')
+
+        for index in indexes:
+            ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+            if postgres:
+                ddl = ddl.replace('INDEX', 'INDEX CONCURRENTLY', 1)
+            click.echo(f"Building index {index.name}")
+            conn.exec_driver_sql(ddl)
+
+        existing = {
+            index['name'] for table in db.metadata.sorted_tables for index in inspect(conn).get_indexes(table.name)
+        }
+        for name in RETIRED_INDEXES:
+            if name in existing:
+                click.echo(f"Dropping retired index {name}")
+                conn.exec_driver_sql(f'DROP INDEX {"CONCURRENTLY " if postgres else ""}IF EXISTS "{name}"')
+
+
+@blogly_cli.command('migrate-cascades')
+def migrate_cascades():
+    """Recreate foreign keys missing their ON DELETE action on Postgres.
+
+    Each constraint is swapped as NOT VALID, which only holds a brief lock,
+    then validated separately while reads and writes continue.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        raise click.ClickException("Only needed on Postgres; recreate SQLite databases with init-db")
+
+    inspector = inspect(engine)
+    for table in db.metadata.sorted_tables:
+        existing = inspector.get_foreign_keys(table.name)
+        for constraint in table.foreign_key_constraints:
+            if constraint.ondelete is None:
+                continue
+            columns = [column.name for column in constraint.columns]
+            for fk in existing:
+                if fk['constrained_columns'] != columns:
+                    continue
+                if (fk['options'].get('ondelete') or '').upper() == constraint.ondelete.upper():
+                    continue
+
+                click.echo(f"Recreating {fk['name']} with ON DELETE {constraint.ondelete}")
+                constraint.name = fk['name']
+                ddl = str(AddConstraint(constraint).compile(dialect=engine.dialect)) + ' NOT VALID'
+                with engine.begin() as conn:
+                    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" DROP CONSTRAINT "{fk["name"]}"')
+                    conn.exec_driver_sql(ddl)
+                with engine.begin() as conn:
+                    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" VALIDATE CONSTRAINT "{fk["name"]}"')
+
+
+def add_missing_column(conn, table, column):
+    """Add `column` to `table` unless it is already there; return whether it was added."""
+    if column.name in {c['name'] for c in inspect(conn).get_columns(table.name)}:
+        return False
+    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+    if_not_exists = ' IF NOT EXISTS' if conn.dialect.name == 'postgresql' else ''
+    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN{if_not_exists} {ddl}')
+    return True
+
+
+@blogly_cli.command('add-timestamps')
+def add_timestamps():
+    """Add the updated_at columns to a database created before they existed.
+
+    Existing rows get the current time. On Postgres the DEFAULT now() is
+    evaluated once, so the column is added without rewriting the table.
+    SQLite only allows a constant default when adding a column.
+    """
+    with db.engine.begin() as conn:
+        for model in (User, Post, Tag):
+            table = model.__table__
+            column = table.c.updated_at
+            if conn.dialect.name == 'sqlite':
+                column = db.Column(
+                    column.name, column.type, nullable=False, server_default=datetime.now().isoformat(' ')
+                )
+            if add_missing_column(conn, table, column):
+                click.echo(f"Added {table.name}.updated_at")
+
+
+def recount_tag_post_counts():
+    """Set every tag's post_count from posts_tags, returning how many changed."""
+    tags = Tag.__table__
+    posts_tags = PostTag.__table__
+    actual = db.select(db.func.count()).where(posts_tags.c.tag_id == tags.c.id).scalar_subquery()
+    with db.engine.begin() as conn:
+        return conn.execute(
+            tags.update().where(tags.c.post_count != actual).values(
+                post_count=actual, updated_at=tags.c.updated_at
+            )
+        ).rowcount
+
+
+@blogly_cli.command('recount-tags')
+def recount_tags():
+    """Recompute tags.post_count from posts_tags.
+
+    Adds the column to a database created before it existed and backfills
+    it, and repairs counts after posts were deleted outside the app.
+    """
+    tags = Tag.__table__
+    with db.engine.begin() as conn:
+        if add_missing_column(conn, tags, tags.c.post_count):
+            click.echo("Added tags.post_count")
+    updated = recount_tag_post_counts()
+    click.echo(f"Corrected {updated} tag counts.")
+
+
+@blogly_cli.command('init-search')
+def init_search():
+    """Add full-text search to a database created before it existed.
+
+    On Postgres this adds the generated search_vector column, which
+    rewrites the posts table, then builds its GIN index concurrently.
+    """
+    engine = db.engine
+    if engine.dialect.name == 'postgresql':
+        column_ddl, index_ddl = POSTGRES_SEARCH_DDL
+        with engine.begin() as conn:
+            conn.exec_driver_sql(column_ddl)
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql(index_ddl.replace('INDEX', 'INDEX CONCURRENTLY', 1))
+    else:
+        with engine.begin() as conn:
+            for statement in SQLITE_SEARCH_DDL:
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')")
+    click.echo("Initialized full-text search.")
+
+
+@blogly_cli.command('export')
+@click.argument('table', type=click.Choice(list(TABLES)))
+@click.option('--format', 'format', type=click.Choice(list(FORMATS)), default='ndjson', show_default=True)
+@click.option('--output', '-o', type=click.File('w'), default='-', help='File to write, stdout by default.')
+@click.option('--batch-size', type=int, default=None, help='Rows per fetch, EXPORT_BATCH_SIZE by default.')
+def export(table, format, output, batch_size):
+    """Stream every row of TABLE as NDJSON or CSV."""
+    batch_size = batch_size or current_app.config['EXPORT_BATCH_SIZE']
+    for chunk in export_rows(table, format, batch_size):
+        output.write(chunk)
+
+
+@blogly_cli.command('import')
+@click.argument('table', type=click.Choice(list(TABLES)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format', type=click.Choice(list(FORMATS)), default=None,
+              help='File format, guessed from the extension by default.')
+@click.option('--batch-size', type=int, default=None, help='Rows per batch, IMPORT_BATCH_SIZE by default.')
+@click.option('--checkpoint', 'checkpoint_name', default=None,
+              help='Name the progress is recorded under, the absolute PATH by default.')
+@click.option('--restart', is_flag=True, help='Ignore an existing checkpoint and load the whole file.')
+def import_(table, path, format, batch_size, checkpoint_name, restart):
+    """Load TABLE from the NDJSON or CSV file at PATH.
+
+    Uses COPY on Postgres and multi-row INSERTs elsewhere, one transaction
+    per batch. If the import stops part way, running it again resumes after
+    the last batch recorded in the import_checkpoints table. Load users before posts
+    and both before post_tags.
+    """
+    format = format or ('csv' if path.endswith('.csv') else 'ndjson')
+    batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+    checkpoint = Checkpoint(checkpoint_name or os.path.abspath(path))
+    if restart:
+        checkpoint.clear()
+    start = checkpoint.load()
+    if start:
+        click.echo(f"Resuming after {start} rows.")
+
+    try:
+        total = import_file(
+            table, path, format, batch_size, checkpoint,
+            progress=lambda done: click.echo(f"Loaded {done} rows.", err=True),
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    checkpoint.clear()
+    if table in ('tags', 'post_tags'):
+        recount_tag_post_counts()
+    click.echo(f"Imported {total - start} rows into {TABLES[table].name}.")
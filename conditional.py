@@ -0,0 +1,38 @@
+"""Conditional GET support for Blogly's detail pages.
+
+A page's validator is derived from one cheap aggregate query over the
+updated_at columns of the rows it shows (see `*_validator` in app.py).
+Revalidation requests that still match are answered with 304 before any
+entity is hydrated or template rendered.
+"""
+
+import hashlib
+from datetime import datetime
+
+from flask import abort, current_app, make_response, request
+from werkzeug.http import is_resource_modified
+
+
+def validators(row):
+    """Turn a validator row into `(etag, last_modified)`, or abort with 404."""
+    if row is None:
+        abort(404)
+    etag = hashlib.sha1(repr(tuple(row)).encode()).hexdigest()
+    last_modified = max(value for value in row if isinstance(value, datetime))
+    return etag, last_modified
+
+
+def add_validators(response, etag, last_modified):
+    """Attach ETag and Last-Modified and ask caches to revalidate."""
+    response = make_response(response)
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, last_modified):
+    """Return a 304 response if the client's copy is current, else None."""
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return add_validators(current_app.response_class(status=304), etag, last_modified)
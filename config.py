@@ -0,0 +1,104 @@
+"""Configuration profiles for Blogly.
+
+`create_app` loads one of these by name and then applies any `BLOGLY_*`
+environment variables on top, e.g. `BLOGLY_SECRET_KEY` or
+`BLOGLY_SQLALCHEMY_DATABASE_URI`.
+"""
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    SQLALCHEMY_DATABASE_URI = 'postgresql:///blogly'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    TEMPLATES_AUTO_RELOAD = False
+    DEBUG = False
+    TESTING = False
+    DEBUG_TOOLBAR = False
+    SECRET_KEY = "SECRET!"
+    # Send per-request db/template/app timings in a Server-Timing header
+    SERVER_TIMING = True
+    USERS_PER_PAGE = 20
+    SEARCH_PER_PAGE = 20
+    POSTS_PER_PAGE = 20
+    API_PER_PAGE = 20
+    # Related ids listed per object by a to-many ?include=
+    API_INCLUDE_LIMIT = 20
+    # Rows fetched per server-side cursor round trip when exporting
+    EXPORT_BATCH_SIZE = 1000
+    # Rows per COPY or INSERT, and per checkpoint, when importing
+    IMPORT_BATCH_SIZE = 5000
+    MAX_PER_PAGE = 100
+
+    # Home page feed, see feed.py. FEED_MAX_AGE bounds, in seconds, how long
+    # a worker may miss posts written by other workers; None never expires.
+    FEED_PER_PAGE = 20
+    FEED_BUFFER_SIZE = 100
+    FEED_MAX_AGE = 5
+
+    # Connection pool, see pooling.build_engine_options. None keeps the
+    # SQLAlchemy default; DB_POOL_CLASS="null" hands pooling to PgBouncer.
+    DB_POOL_CLASS = 'queue'
+    DB_POOL_SIZE = None
+    DB_MAX_OVERFLOW = None
+    DB_POOL_TIMEOUT = None
+    DB_POOL_RECYCLE = None
+    DB_POOL_PRE_PING = False
+
+    # Rendered-page cache, see cache.py: "lru", "filesystem" or "null".
+    # PAGE_CACHE_TTL bounds, in seconds, how long a worker may serve a page
+    # after another worker changed its data; None never expires.
+    PAGE_CACHE_BACKEND = 'lru'
+    PAGE_CACHE_MAX_ENTRIES = 1024
+    PAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    PAGE_CACHE_TTL = 30
+    PAGE_CACHE_DIR = None
+
+    # Slow-query log, see slowlog.py. Statements slower than the threshold in
+    # seconds (None disables the log) go to a rotating file, or to the
+    # blogly.slow_queries logger if SLOW_QUERY_LOG is None; that share of
+    # slow SELECTs also logs its EXPLAIN (ANALYZE, BUFFERS) plan.
+    SLOW_QUERY_THRESHOLD = 0.5
+    SLOW_QUERY_EXPLAIN_RATE = 0.1
+    SLOW_QUERY_LOG = None
+    SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+    SLOW_QUERY_LOG_BACKUPS = 5
+
+    # Where the tag listing's post counts come from: the tags.post_count
+    # column ("denormalized") or a GROUP BY over posts_tags ("aggregate")
+    TAG_POST_COUNTS = 'denormalized'
+
+
+class DevelopmentConfig(Config):
+    """Local development: SQL echo, template reloading and the debug toolbar."""
+
+    SQLALCHEMY_ECHO = True
+    TEMPLATES_AUTO_RELOAD = True
+    DEBUG = True
+    DEBUG_TOOLBAR = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+    PAGE_CACHE_BACKEND = 'null'
+
+
+class TestingConfig(Config):
+    """The test suite."""
+
+    SQLALCHEMY_DATABASE_URI = 'postgresql:///blogly_test'
+    TESTING = True
+
+
+class ProductionConfig(Config):
+    """Serving real traffic. The secret key must come from the environment."""
+
+    SECRET_KEY = None
+    SERVER_TIMING = False
+    DB_POOL_RECYCLE = 1800
+    DB_POOL_PRE_PING = True
+
+
+profiles = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
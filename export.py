@@ -0,0 +1,64 @@
+"""Streaming export of Blogly's tables as NDJSON or CSV.
+
+Rows are read through a server-side cursor (`yield_per`) and written out
+one batch at a time, so exporting a table holds a single batch in memory
+however large the table is. Used by `/api/v1/export/<table>` and
+`flask blogly export`.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+
+from models import db, User, Post, Tag, PostTag
+
+TABLES = {
+    'users': User.__table__,
+    'posts': Post.__table__,
+    'tags': Tag.__table__,
+    'post_tags': PostTag.__table__,
+}
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _ndjson(columns, batch):
+    return ''.join(json.dumps(dict(zip(columns, row)), default=_json_default) + '\n' for row in batch)
+
+
+def _csv(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        [value.isoformat() if isinstance(value, datetime) else value for value in row] for row in rows
+    )
+    return buffer.getvalue()
+
+
+def export_rows(name, format, batch_size=1000):
+    """Yield the rows of table `name` as text chunks, one per batch."""
+    table = TABLES[name]
+    columns = [column.name for column in table.columns]
+    statement = (
+        select(*table.columns)
+        .order_by(*table.primary_key.columns)
+        .execution_options(yield_per=batch_size)
+    )
+
+    if format == 'csv':
+        yield _csv([columns])
+    for batch in db.session.execute(statement).partitions():
+        if format == 'csv':
+            yield _csv(batch)
+        else:
+            yield _ndjson(columns, batch)
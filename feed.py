@@ -0,0 +1,198 @@
+"""The home page's feed of recent posts from every user.
+
+The first page of the feed is the most requested URL, so the newest posts
+are kept in a bounded in-memory ring buffer. Committed sessions update it
+in place: new posts are pushed onto the front, deleted posts are dropped
+and edits are applied to the entries they touch. A hit renders without
+touching the database.
+
+Each worker process has its own buffer and only sees the writes it served
+itself, so the buffer is also reloaded once it is FEED_MAX_AGE seconds old.
+Later pages are read from the database with keyset pagination.
+"""
+
+import threading
+import time
+from collections import deque, namedtuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import db, User, Post
+from pagination import Page, encode_cursor
+
+OPS_KEY = 'recent_posts_ops'
+
+FeedEntry = namedtuple('FeedEntry', 'id title created_at user_id author')
+
+
+def feed_query():
+    """Query every post as a feed row, ready for keyset pagination."""
+    author = (User.first_name + ' ' + User.last_name).label('author')
+    return db.session.query(Post.id, Post.title, Post.created_at, Post.user_id, author).join(Post.user)
+
+
+class RecentPosts:
+    """Ring buffer of the newest feed entries, newest first."""
+
+    def __init__(self, capacity=100, max_age=None):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._entries = deque(maxlen=capacity)
+        self._loaded_at = None
+        # True when the buffer holds every post there is
+        self._complete = False
+        self._lock = threading.Lock()
+
+    def first_page(self, per_page):
+        """Return the first `Page` of the feed, or None if `per_page` is too big.
+
+        Loads the buffer from the database if it is cold or expired.
+        """
+        if per_page > self.capacity:
+            return None
+
+        with self._lock:
+            if self._servable(per_page):
+                self.hits += 1
+                entries = list(self._entries)
+                return self._page(entries, per_page, len(entries) > per_page or not self._complete)
+            self.misses += 1
+
+        rows = feed_query().order_by(Post.created_at.desc(), Post.id.desc()).limit(self.capacity + 1).all()
+        entries = [FeedEntry(*row) for row in rows[:self.capacity]]
+        with self._lock:
+            self._entries = deque(entries, maxlen=self.capacity)
+            self._complete = len(rows) <= self.capacity
+            self._loaded_at = time.monotonic()
+        return self._page(entries, per_page, len(rows) > per_page)
+
+    @staticmethod
+    def _page(entries, per_page, has_more):
+        entries = entries[:per_page]
+        last = entries[-1] if entries else None
+        next_cursor = encode_cursor((last.created_at, last.id)) if has_more and last else None
+        return Page(entries, next_cursor=next_cursor)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def apply(self, ops):
+        """Apply changes queued by a committed session."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            for op, value in ops:
+                if op == 'push':
+                    if value.author is None:
+                        value = self._with_author(value)
+                        if value is None:
+                            # Nothing here names the author; reload next time
+                            self._loaded_at = None
+                            return
+                    self._push(value)
+                elif op == 'forget_post':
+                    self._remove(lambda entry: entry.id == value)
+                elif op == 'forget_user':
+                    self._remove(lambda entry: entry.user_id == value)
+                elif op == 'retitle':
+                    post_id, title = value
+                    self._replace(lambda entry: entry.id == post_id, title=title)
+                elif op == 'rename':
+                    user_id, author = value
+                    self._replace(lambda entry: entry.user_id == user_id, author=author)
+
+    def _servable(self, per_page):
+        if self._loaded_at is None:
+            return False
+        if self.max_age is not None and time.monotonic() - self._loaded_at > self.max_age:
+            return False
+        return len(self._entries) >= per_page or self._complete
+
+    def _with_author(self, entry):
+        for other in self._entries:
+            if other.user_id == entry.user_id:
+                return entry._replace(author=other.author)
+        return None
+
+    def _push(self, entry):
+        key = (entry.created_at, entry.id)
+        entries = list(self._entries)
+        position = 0
+        while position < len(entries) and (entries[position].created_at, entries[position].id) > key:
+            position += 1
+        if position == len(entries) and len(entries) == self.capacity:
+            # Older than everything in a full buffer
+            return
+        if len(entries) == self.capacity:
+            # The oldest entry falls off, so the buffer no longer has every post
+            self._complete = False
+        entries.insert(position, entry)
+        self._entries = deque(entries, maxlen=self.capacity)
+
+    def _remove(self, predicate):
+        self._entries = deque((e for e in self._entries if not predicate(e)), maxlen=self.capacity)
+
+    def _replace(self, predicate, **changes):
+        self._entries = deque(
+            (e._replace(**changes) if predicate(e) else e for e in self._entries), maxlen=self.capacity
+        )
+
+
+def init_app(app):
+    app.extensions['recent_posts'] = RecentPosts(app.config['FEED_BUFFER_SIZE'], app.config['FEED_MAX_AGE'])
+
+
+def forget_post(post_id):
+    """Drop a post deleted by a bulk statement once the session commits."""
+    db.session.info.setdefault(OPS_KEY, []).append(('forget_post', post_id))
+
+
+def forget_user(user_id):
+    """Drop a deleted user's posts once the session commits."""
+    db.session.info.setdefault(OPS_KEY, []).append(('forget_user', user_id))
+
+
+def _loaded_author(session, post):
+    """Name the post's author if the session already holds them, without a query.
+
+    Otherwise the buffer takes the name from the author's other entries.
+    """
+    user = inspect(post).dict.get('user') or session.identity_map.get(session.identity_key(User, post.user_id))
+    return str(user) if user is not None else None
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_ops(session, flush_context):
+    ops = session.info.setdefault(OPS_KEY, [])
+    for obj in session.new:
+        if isinstance(obj, Post):
+            ops.append(('push', FeedEntry(obj.id, obj.title, obj.created_at, obj.user_id, _loaded_author(session, obj))))
+    for obj in session.dirty:
+        if isinstance(obj, Post):
+            ops.append(('retitle', (obj.id, obj.title)))
+        elif isinstance(obj, User):
+            ops.append(('rename', (obj.id, str(obj))))
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            ops.append(('forget_post', obj.id))
+        elif isinstance(obj, User):
+            ops.append(('forget_user', obj.id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_ops(session):
+    ops = session.info.pop(OPS_KEY, None)
+    if ops and has_app_context():
+        recent_posts = current_app.extensions.get('recent_posts')
+        if recent_posts is not None:
+            recent_posts.apply(ops)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_ops(session):
+    session.info.pop(OPS_KEY, None)
@@ -0,0 +1,120 @@
+"""Per-request timing for Blogly.
+
+Every request counts the SQL statements it runs and splits its wall time
+into time spent in the database, rendering templates, and the Python around
+them. With SERVER_TIMING on, the numbers are sent back in a Server-Timing
+header, which browser developer tools show next to each request:
+
+    Server-Timing: db;dur=4.1;desc="3 queries", tpl;dur=2.3, app;dur=1.2, total;dur=7.6
+
+Statements are timed by listeners on every Engine, so they cover the engine
+`connect_db` sets up as well as any other. Other modules can see each
+statement's duration through `on_statement` instead of timing it again.
+"""
+
+import time
+
+from flask import before_render_template, g, has_app_context, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUERY_START_KEY = 'query_start'
+
+# Called as listener(conn, statement, parameters, executemany, elapsed)
+_statement_listeners = []
+
+
+class RequestTiming:
+    """Where one request's time went, in seconds."""
+
+    __slots__ = ('start', 'queries', 'db', 'template', 'render_start')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.render_start = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        total = self.elapsed()
+        app = max(0.0, total - self.db - self.template)
+        return (
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries", '
+            f'tpl;dur={self.template * 1000:.1f}, '
+            f'app;dur={app * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+
+
+def on_statement(listener):
+    """Register `listener` to be called after every statement with its duration."""
+    _statement_listeners.append(listener)
+    return listener
+
+
+def current_timing():
+    """Return the running request's `RequestTiming`, or None outside one."""
+    if has_app_context():
+        return g.get('request_timing')
+    return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(QUERY_START_KEY, []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info[QUERY_START_KEY].pop()
+    timing = current_timing()
+    if timing is not None:
+        timing.queries += 1
+        timing.db += elapsed
+    for listener in _statement_listeners:
+        listener(conn, statement, parameters, executemany, elapsed)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _failed_query(exception_context):
+    # after_cursor_execute never runs for a statement that raised
+    conn = exception_context.connection
+    if conn is not None and conn.info.get(QUERY_START_KEY):
+        conn.info[QUERY_START_KEY].pop()
+
+
+def _start_request():
+    g.request_timing = RequestTiming()
+
+
+def _start_render(app, template, context, **extra):
+    timing = current_timing()
+    if timing is not None:
+        timing.render_start = time.perf_counter()
+
+
+def _end_render(app, template, context, **extra):
+    timing = current_timing()
+    if timing is not None and timing.render_start is not None:
+        timing.template += time.perf_counter() - timing.render_start
+        timing.render_start = None
+
+
+def _add_server_timing(response):
+    timing = current_timing()
+    if timing is not None:
+        response.headers['Server-Timing'] = timing.server_timing()
+    return response
+
+
+def init_app(app):
+    """Time every request of `app`, adding Server-Timing if SERVER_TIMING is set."""
+    app.before_request(_start_request)
+    if app.config['SERVER_TIMING']:
+        app.after_request(_add_server_timing)
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_end_render, app)
@@ -0,0 +1,247 @@
+"""Prometheus metrics for Blogly, served at /metrics.
+
+Per endpoint name: request counts by status, latency and response size
+histograms, database statements, and page cache hits and misses. Alongside
+them, the connection pool's gauges from `pooling.pool_stats` and the home
+page feed's buffer hits and misses.
+
+Recording has to be cheap on every request in a threaded worker, so each
+thread writes only to its own shard and takes no lock. A scrape copies
+every shard and adds them up; the lock is only taken when a thread first
+records, and when it exits and its shard is folded into a retired total,
+so servers starting a thread per request do not pile up shards.
+"""
+
+import bisect
+import threading
+import weakref
+
+from flask import current_app, g, request
+
+from instrumentation import current_timing
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# pool_stats key -> (metric, type, help)
+POOL_METRICS = {
+    'size': ('blogly_db_pool_size', 'gauge', 'Connections the pool keeps open.'),
+    'checked_in': ('blogly_db_pool_checked_in', 'gauge', 'Idle connections in the pool.'),
+    'checked_out': ('blogly_db_pool_checked_out', 'gauge', 'Connections in use.'),
+    'overflow': ('blogly_db_pool_overflow', 'gauge', 'Connections open beyond the pool size.'),
+    'max_overflow': ('blogly_db_pool_max_overflow', 'gauge', 'Most connections allowed beyond the pool size.'),
+    'timeout_seconds': ('blogly_db_pool_timeout_seconds', 'gauge', 'How long a checkout waits before failing.'),
+    'checkouts': ('blogly_db_pool_checkouts_total', 'counter', 'Connections taken from the pool.'),
+    'wait_total_seconds': ('blogly_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for connections.'),
+    'wait_max_seconds': ('blogly_db_pool_wait_max_seconds', 'gauge', 'Longest wait for a connection.'),
+    'timeouts': ('blogly_db_pool_timeouts_total', 'counter', 'Checkouts that timed out.'),
+}
+
+
+class Histogram:
+    """Bucket counts, not yet cumulative, plus the sum of observations."""
+
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, buckets):
+        # The last slot is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, buckets, value):
+        self.counts[bisect.bisect_left(buckets, value)] += 1
+        self.sum += value
+
+
+class Shard:
+    """One thread's share of the metrics."""
+
+    def __init__(self):
+        self.requests = {}   # (endpoint, status) -> count
+        self.latency = {}    # endpoint -> Histogram
+        self.sizes = {}      # endpoint -> Histogram
+        self.queries = {}    # endpoint -> count
+        self.page_cache = {}  # (endpoint, 'hit' | 'miss') -> count
+
+
+class _Owner:
+    """Lives in a thread's local storage, so it is collected when the thread ends."""
+
+    __slots__ = ('__weakref__',)
+
+
+def _merge(into, shard):
+    """Add `shard`'s counts to the `Shard` `into`."""
+    # dict.copy() is atomic under the GIL, so a thread adding a key while we
+    # read cannot break the iteration
+    for name in ('requests', 'queries', 'page_cache'):
+        merged = getattr(into, name)
+        for key, value in getattr(shard, name).copy().items():
+            merged[key] = merged.get(key, 0) + value
+    for name, buckets in (('latency', LATENCY_BUCKETS), ('sizes', SIZE_BUCKETS)):
+        merged = getattr(into, name)
+        for endpoint, histogram in getattr(shard, name).copy().items():
+            total = merged.get(endpoint)
+            if total is None:
+                total = merged[endpoint] = Histogram(buckets)
+            total.counts = [a + b for a, b in zip(total.counts, list(histogram.counts))]
+            total.sum += histogram.sum
+
+
+class Metrics:
+    """Per-thread sharded request metrics for one app."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        # Everything recorded by threads that have since exited
+        self._retired = Shard()
+        # Reentrant: a shard's finalizer may run in whichever thread drops
+        # the last reference, including one already holding the lock
+        self._lock = threading.RLock()
+
+    def shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = Shard()
+            self._local.owner = owner = _Owner()
+            weakref.finalize(owner, self._retire, shard)
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            self._shards.remove(shard)
+            _merge(self._retired, shard)
+
+    def observe(self, endpoint, status, duration, size=None, queries=0, page_cache=None):
+        """Record one finished request."""
+        shard = self.shard()
+        key = (endpoint, status)
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+
+        latency = shard.latency.get(endpoint)
+        if latency is None:
+            latency = shard.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+        latency.observe(LATENCY_BUCKETS, duration)
+
+        if size is not None:
+            sizes = shard.sizes.get(endpoint)
+            if sizes is None:
+                sizes = shard.sizes[endpoint] = Histogram(SIZE_BUCKETS)
+            sizes.observe(SIZE_BUCKETS, size)
+
+        shard.queries[endpoint] = shard.queries.get(endpoint, 0) + queries
+        if page_cache is not None:
+            key = (endpoint, page_cache)
+            shard.page_cache[key] = shard.page_cache.get(key, 0) + 1
+
+    def collect(self):
+        """Add up every shard into one `Shard`."""
+        total = Shard()
+        with self._lock:
+            shards = list(self._shards)
+            _merge(total, self._retired)
+        for shard in shards:
+            _merge(total, shard)
+        return total
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Exposition:
+    """Builds the Prometheus text format, one metric family at a time."""
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help):
+        self.lines.append(f'# HELP {name} {help}')
+        self.lines.append(f'# TYPE {name} {kind}')
+
+    def sample(self, name, value, **labels):
+        self.lines.append(f'{name}{_labels(**labels) if labels else ""} {_number(value)}')
+
+    def histogram(self, name, buckets, histograms, help):
+        self.family(name, 'histogram', help)
+        for endpoint, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), histogram.counts):
+                cumulative += count
+                self.sample(f'{name}_bucket', cumulative, endpoint=endpoint, le=bound)
+            self.sample(f'{name}_sum', histogram.sum, endpoint=endpoint)
+            self.sample(f'{name}_count', cumulative, endpoint=endpoint)
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def render(metrics, pool=None, recent_posts=None):
+    """Return every metric in the Prometheus text format."""
+    total = metrics.collect()
+    out = Exposition()
+
+    out.family('blogly_requests_total', 'counter', 'Requests served, by endpoint and status.')
+    for (endpoint, status), count in sorted(total.requests.items()):
+        out.sample('blogly_requests_total', count, endpoint=endpoint, status=status)
+
+    out.histogram('blogly_request_duration_seconds', LATENCY_BUCKETS, total.latency,
+                  'Time from routing a request to its response.')
+    out.histogram('blogly_response_size_bytes', SIZE_BUCKETS, total.sizes,
+                  'Response body sizes; streamed responses are not counted.')
+
+    out.family('blogly_db_queries_total', 'counter', 'SQL statements run while serving requests.')
+    for endpoint, count in sorted(total.queries.items()):
+        out.sample('blogly_db_queries_total', count, endpoint=endpoint)
+
+    out.family('blogly_page_cache_requests_total', 'counter', 'Cached views served from the page cache or rendered.')
+    for (endpoint, result), count in sorted(total.page_cache.items()):
+        out.sample('blogly_page_cache_requests_total', count, endpoint=endpoint, result=result)
+
+    if pool is not None:
+        for key, (name, kind, help) in POOL_METRICS.items():
+            if key in pool:
+                out.family(name, kind, help)
+                out.sample(name, pool[key])
+
+    if recent_posts is not None:
+        out.family('blogly_feed_buffer_requests_total', 'counter', 'Home page feeds served from the buffer or loaded.')
+        out.sample('blogly_feed_buffer_requests_total', recent_posts.hits, result='hit')
+        out.sample('blogly_feed_buffer_requests_total', recent_posts.misses, result='miss')
+
+    return out.render()
+
+
+def _record_request(response):
+    timing = current_timing()
+    if timing is None:
+        return response
+    size = None if response.is_streamed else response.content_length
+    current_app.extensions['metrics'].observe(
+        request.endpoint or 'unmatched',
+        response.status_code,
+        timing.elapsed(),
+        size=size,
+        queries=timing.queries,
+        page_cache=g.get('page_cache_result'),
+    )
+    return response
+
+
+def init_app(app):
+    """Record every request of `app`; call after `instrumentation.init_app`."""
+    app.extensions['metrics'] = Metrics()
+    app.after_request(_record_request)
@@ -1,8 +1,21 @@
 """Models for Blogly."""
+from collections import Counter
+from datetime import datetime
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
 
 db = SQLAlchemy()
 
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite ignores foreign keys, and so ON DELETE CASCADE, unless asked."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
 def connect_db(app):
     """Connect to database."""
 
@@ -14,6 +27,10 @@ class User(db.Model):
     """User."""
 
     __tablename__ = 'users'
+    __table_args__ = (
+        # Backs the keyset pagination of the user listing
+        db.Index('ix_users_last_name_first_name_id', 'last_name', 'first_name', 'id'),
+    )
 
     def __repr__(self):
         u = self
@@ -26,13 +43,30 @@ class User(db.Model):
     first_name = db.Column(db.String(50), nullable=False, unique=False)
     last_name = db.Column(db.String(50), nullable=False, unique=False)
     image_url = db.Column(db.String(200), nullable=False, unique=False)
-    posts = db.relationship('Post', backref='user', cascade='all')
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now, server_default=db.func.now()
+    )
+    # Deleting a user's posts and their tags is left to ON DELETE CASCADE
+    posts = db.relationship(
+        'Post', backref='user', cascade='all', passive_deletes=True, order_by='Post.created_at.desc()'
+    )
+
+
+# Indexes the models no longer define, dropped by `flask blogly create-indexes`
+RETIRED_INDEXES = ['ix_posts_created_at_id']
 
 
 class Post(db.Model):
     """Post."""
 
     __tablename__ = 'posts'
+    __table_args__ = (
+        # A user's posts, newest first
+        db.Index('ix_posts_user_id_created_at', 'user_id', db.text('created_at DESC')),
+        # All posts in chronological order; covers the home page feed. It
+        # replaced ix_posts_created_at_id, see RETIRED_INDEXES
+        db.Index('ix_posts_created_at_id_covering', 'created_at', 'id', postgresql_include=['title', 'user_id']),
+    )
 
     def __repr__(self):
         p = self
@@ -45,8 +79,44 @@ class Post(db.Model):
     title = db.Column(db.String(50), nullable=False, unique=False)
     content = db.Column(db.String(200), nullable=False, unique=False)
     created_at = db.Column(db.DateTime, nullable=False, unique=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=False)
-    tags = db.relationship('Tag', secondary='posts_tags', backref='posts')
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now, server_default=db.func.now()
+    )
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, unique=False)
+    tags = db.relationship(
+        'Tag', secondary='posts_tags', passive_deletes=True, backref=db.backref('posts', passive_deletes=True)
+    )
+
+
+# Full-text search over posts (see search.py). The schema differs per
+# database, so it is created alongside the posts table rather than mapped.
+POSTGRES_SEARCH_DDL = [
+    """ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(content, '')), 'B')
+        ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_posts_search_vector ON posts USING GIN (search_vector)",
+]
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(title, content, content='posts', content_rowid='id')",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF title, content ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+]
+
+for statement in POSTGRES_SEARCH_DDL:
+    event.listen(Post.__table__, 'after_create', db.DDL(statement).execute_if(dialect='postgresql'))
+for statement in SQLITE_SEARCH_DDL:
+    event.listen(Post.__table__, 'after_create', db.DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Post.__table__, 'before_drop', db.DDL('DROP TABLE IF EXISTS posts_fts').execute_if(dialect='sqlite'))
 
 
 class Tag(db.Model):
@@ -63,11 +133,20 @@ class Tag(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now, server_default=db.func.now()
+    )
+    # Denormalized count of posts_tags rows, see adjust_tag_post_counts
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
 class PostTag(db.Model):
     """PostTag."""
 
     __tablename__ = 'posts_tags'
+    __table_args__ = (
+        # The primary key only serves lookups by post
+        db.Index('ix_posts_tags_tag_id_post_id', 'tag_id', 'post_id'),
+    )
 
     def __repr__(self):
         pt = self
@@ -76,6 +155,81 @@ class PostTag(db.Model):
     def __str__(self) -> str:
         return f"{self.post_id} {self.tag_id}"
 
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True, nullable=False, unique=False)
-    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id'), primary_key=True, nullable=False, unique=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True, nullable=False, unique=False)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True, nullable=False, unique=False)
 
+class ImportCheckpoint(db.Model):
+    """How far an interrupted bulk import got, see bulk_import.Checkpoint."""
+
+    __tablename__ = 'import_checkpoints'
+
+    def __repr__(self):
+        c = self
+        return f"<ImportCheckpoint name={c.name} rows={c.rows}>"
+
+    name = db.Column(db.Text, primary_key=True)
+    rows = db.Column(db.Integer, nullable=False)
+
+
+def adjust_tag_post_counts(session, deltas):
+    """Apply a {tag_id: delta} mapping to tags.post_count.
+
+    Runs one UPDATE per distinct delta in the session's transaction, so the
+    counts commit or roll back together with the posts_tags rows.
+    """
+    by_delta = {}
+    for tag_id, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(tag_id)
+
+    tags = Tag.__table__
+    for delta, tag_ids in by_delta.items():
+        session.connection().execute(
+            tags.update().where(tags.c.id.in_(tag_ids)).values(
+                post_count=tags.c.post_count + delta,
+                # A count change is not an edit of the tag
+                updated_at=tags.c.updated_at,
+            )
+        )
+
+
+def release_tag_post_counts(session, post_ids):
+    """Decrement the counts of every tag on `post_ids` before they are deleted.
+
+    `post_ids` may be a list or a subquery; it is a single UPDATE either way.
+    Returns the ids of the tags it touched.
+    """
+    tags = Tag.__table__
+    posts_tags = PostTag.__table__
+    removed = db.select(db.func.count()).where(
+        posts_tags.c.tag_id == tags.c.id,
+        posts_tags.c.post_id.in_(post_ids),
+    ).scalar_subquery()
+    return session.connection().execute(
+        tags.update().where(
+            tags.c.id.in_(db.select(posts_tags.c.tag_id).where(posts_tags.c.post_id.in_(post_ids)))
+        ).values(post_count=tags.c.post_count - removed, updated_at=tags.c.updated_at).returning(tags.c.id)
+    ).scalars().all()
+
+
+@event.listens_for(Session, 'after_flush')
+def count_orm_tag_changes(session, flush_context):
+    """Keep tags.post_count in step with posts_tags rows written by the ORM."""
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, PostTag):
+            deltas[obj.tag_id] += 1
+    for obj in session.deleted:
+        if isinstance(obj, PostTag):
+            deltas[obj.tag_id] -= 1
+        elif isinstance(obj, Post) and 'tags' in inspect(obj).dict:
+            for tag in obj.tags:
+                deltas[tag.id] -= 1
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, Post):
+            history = inspect(obj).attrs.tags.history
+            for tag in history.added:
+                deltas[tag.id] += 1
+            for tag in history.deleted:
+                deltas[tag.id] -= 1
+    adjust_tag_post_counts(session, deltas)
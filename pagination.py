@@ -0,0 +1,134 @@
+"""Keyset (cursor) pagination for Blogly.
+
+Pages are addressed by the sort key of the row at their edge instead of by
+an OFFSET, so fetching the ten-thousandth page costs the same index range
+scan as fetching the first one.
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from flask import abort, current_app, request
+from sqlalchemy import tuple_
+
+
+class Page:
+    """One page of rows plus the cursors pointing at its neighbours."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __repr__(self):
+        return f"<Page items={len(self.items)} next={self.next_cursor} prev={self.prev_cursor}>"
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    """Encode a tuple of sort key values as an opaque, URL-safe token."""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, columns):
+    """Decode a token made by `encode_cursor`, aborting with 400 if it is bad."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        abort(400, 'Invalid pagination cursor')
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        abort(400, 'Invalid pagination cursor')
+
+    decoded = []
+    for column, value in zip(columns, values):
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = None
+
+        if python_type is datetime and isinstance(value, str):
+            try:
+                value = datetime.fromisoformat(value)
+            except ValueError:
+                abort(400, 'Invalid pagination cursor')
+        elif not _matches(value, python_type):
+            abort(400, 'Invalid pagination cursor')
+        decoded.append(value)
+    return tuple(decoded)
+
+
+def _matches(value, python_type):
+    """Whether a decoded JSON value can be compared with a column of `python_type`."""
+    # bool is an int subclass, but never a sort key
+    if isinstance(value, bool) or value is None:
+        return False
+    if python_type is float:
+        return isinstance(value, (int, float))
+    if python_type is None:
+        # Columns without a known type (SQL functions such as bm25) take any scalar
+        return isinstance(value, (int, float, str))
+    return isinstance(value, python_type)
+
+
+def per_page_arg(default):
+    """Read ?per_page= from the request, clamped to MAX_PER_PAGE."""
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, current_app.config.get('MAX_PER_PAGE', 100)))
+
+
+def keyset_paginate(query, columns, after=None, before=None, per_page=20, descending=False, key=None):
+    """Return one `Page` of `query` ordered by `columns`.
+
+    `columns` must form a unique sort key (end it with the primary key) and
+    should be backed by a composite index in the same order. `after` and
+    `before` are cursors produced by a previous page; at most one may be
+    given. `key` maps a result row to its sort key values and defaults to
+    reading each column's attribute name off the row.
+    """
+    if after and before:
+        abort(400, 'Only one of after/before may be given')
+
+    if key is None:
+        names = [column.key for column in columns]
+        key = lambda row: tuple(getattr(row, name) for name in names)
+
+    sort_key = tuple_(*columns)
+    forward = [c.desc() if descending else c.asc() for c in columns]
+    backward = [c.asc() if descending else c.desc() for c in columns]
+
+    if before:
+        values = tuple_(*decode_cursor(before, columns))
+        condition = sort_key > values if descending else sort_key < values
+        rows = query.filter(condition).order_by(*backward).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        return Page(
+            rows,
+            next_cursor=encode_cursor(key(rows[-1])) if rows else None,
+            prev_cursor=encode_cursor(key(rows[0])) if has_more else None,
+        )
+
+    if after:
+        values = tuple_(*decode_cursor(after, columns))
+        query = query.filter(sort_key < values if descending else sort_key > values)
+
+    rows = query.order_by(*forward).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    return Page(
+        rows,
+        next_cursor=encode_cursor(key(rows[-1])) if has_more else None,
+        prev_cursor=encode_cursor(key(rows[0])) if after and rows else None,
+    )
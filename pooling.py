@@ -0,0 +1,116 @@
+"""Connection pool configuration and statistics for Blogly."""
+
+import threading
+import time
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+# Engine options that only apply to a QueuePool, and their config keys
+QUEUE_POOL_OPTIONS = {
+    'pool_size': 'DB_POOL_SIZE',
+    'max_overflow': 'DB_MAX_OVERFLOW',
+    'pool_timeout': 'DB_POOL_TIMEOUT',
+}
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waits for a connection.
+
+    Only the wait for a free connection counts: time spent opening a new
+    one is left out, and QueuePool's own retries are part of the checkout
+    that made them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        # Per thread: whether a checkout is under way, and its connect time
+        self._checkout = threading.local()
+
+    def _do_get(self):
+        checkout = self._checkout
+        if getattr(checkout, 'active', False):
+            return super()._do_get()
+        checkout.active = True
+        checkout.connecting = 0.0
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            with self._wait_lock:
+                self._timeouts += 1
+            raise
+        finally:
+            checkout.active = False
+            waited = time.perf_counter() - start - checkout.connecting
+            with self._wait_lock:
+                self._waits += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+
+    def _create_connection(self):
+        start = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            self._checkout.connecting = getattr(self._checkout, 'connecting', 0.0) + time.perf_counter() - start
+
+    def wait_stats(self):
+        """Return checkout wait totals since the pool was created."""
+        with self._wait_lock:
+            return {
+                'checkouts': self._waits,
+                'wait_total_seconds': self._wait_total,
+                'wait_max_seconds': self._wait_max,
+                'timeouts': self._timeouts,
+            }
+
+
+def build_engine_options(config):
+    """Translate the DB_POOL_* config keys into SQLAlchemy engine options.
+
+    DB_POOL_CLASS="null" selects NullPool, for running behind an external
+    pooler such as PgBouncer. Otherwise non-SQLite databases get an
+    InstrumentedQueuePool sized by DB_POOL_SIZE, DB_MAX_OVERFLOW and
+    DB_POOL_TIMEOUT. Explicit SQLALCHEMY_ENGINE_OPTIONS win over both.
+    """
+    options = {}
+    backend = make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+
+    if config['DB_POOL_CLASS'] == 'null':
+        options['poolclass'] = NullPool
+    elif backend != 'sqlite':
+        options['poolclass'] = InstrumentedQueuePool
+        for option, key in QUEUE_POOL_OPTIONS.items():
+            if config[key] is not None:
+                options[option] = config[key]
+
+    if config['DB_POOL_RECYCLE'] is not None:
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+    options['pool_pre_ping'] = config['DB_POOL_PRE_PING']
+
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+def pool_stats(pool):
+    """Return a snapshot of a pool's occupancy as a dict."""
+    stats = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+            'timeout_seconds': pool.timeout(),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(pool.wait_stats())
+    return stats
@@ -0,0 +1,56 @@
+"""Full-text search over post titles and content.
+
+Postgres matches against the generated, GIN-indexed posts.search_vector
+column; SQLite uses the posts_fts FTS5 table. Both are created with the
+posts table in models.py. Results are ranked, keyset-paginated on
+(rank, id) and carry a highlighted snippet of the post's content.
+"""
+
+from markupsafe import Markup, escape
+from sqlalchemy import literal_column
+
+from models import db, Post
+from pagination import keyset_paginate
+
+# Private-use characters mark matches inside snippets until they are escaped
+START, STOP = '\ue000', '\ue001'
+HEADLINE_OPTIONS = f"StartSel={START}, StopSel={STOP}, MaxWords=30, MinWords=10, MaxFragments=2"
+
+
+def highlight(snippet):
+    """Escape a raw snippet and wrap its matches in <mark>."""
+    return Markup(str(escape(snippet or '')).replace(START, '<mark>').replace(STOP, '</mark>'))
+
+
+def fts5_query(q):
+    """Quote every word so user input cannot break FTS5 query syntax."""
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in q.split())
+
+
+def search_posts(q, after=None, before=None, per_page=20):
+    """Return a `Page` of posts matching `q`, best match first.
+
+    Each row has id, title, created_at, user_id, rank and snippet; the
+    snippet is raw text, see `highlight`.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        query = db.func.websearch_to_tsquery('english', q)
+        vector = literal_column('posts.search_vector')
+        # ts_rank_cd() returns real; a float4 never equals the float8 a
+        # cursor carries back, so ties at a page edge would be skipped
+        rank = db.cast(db.func.ts_rank_cd(vector, query), db.Double).label('rank')
+        snippet = db.func.ts_headline('english', Post.content, query, HEADLINE_OPTIONS).label('snippet')
+        base = db.session.query(Post.id, Post.title, Post.created_at, Post.user_id, rank, snippet).filter(
+            vector.op('@@')(query)
+        )
+    else:
+        fts = db.table('posts_fts', db.column('rowid'))
+        match = literal_column('posts_fts')
+        # bm25() is lower for better matches
+        rank = (-db.func.bm25(match)).label('rank')
+        snippet = db.func.snippet(match, 1, START, STOP, '…', 16).label('snippet')
+        base = db.session.query(Post.id, Post.title, Post.created_at, Post.user_id, rank, snippet).join(
+            fts, fts.c.rowid == Post.id
+        ).filter(match.op('MATCH')(fts5_query(q)))
+
+    return keyset_paginate(base, (rank, Post.id), after=after, before=before, per_page=per_page, descending=True)
@@ -0,0 +1,120 @@
+"""Slow-query log for Blogly.
+
+Any statement slower than SLOW_QUERY_THRESHOLD seconds is logged as one
+JSON line with its duration, parameters and the request that ran it, to a
+rotating SLOW_QUERY_LOG file or, if that is unset, to the
+`blogly.slow_queries` logger. A SLOW_QUERY_EXPLAIN_RATE share of slow
+SELECTs also records the query plan: EXPLAIN (ANALYZE, BUFFERS) on Postgres,
+EXPLAIN QUERY PLAN on SQLite. ANALYZE runs the query again, which is why it
+is sampled.
+
+Durations come from instrumentation.py's statement timing, so unlike
+SQLALCHEMY_ECHO the log costs nothing beyond a comparison per statement and
+can stay on in production.
+"""
+
+import json
+import logging
+import os
+import random
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import current_app, has_app_context, has_request_context, request
+
+from instrumentation import on_statement
+
+logger = logging.getLogger('blogly.slow_queries')
+
+MAX_PARAMETERS_LENGTH = 1000
+
+
+class SlowQueryLog:
+    """Decides which statements are slow and writes them out."""
+
+    def __init__(self, threshold, explain_rate=0.0, logger=logger):
+        self.threshold = threshold
+        self.explain_rate = explain_rate
+        self.logger = logger
+
+    def record(self, conn, statement, parameters, elapsed, executemany):
+        entry = {
+            'time': datetime.now().isoformat(),
+            'duration_ms': round(elapsed * 1000, 3),
+            'statement': statement,
+            'parameters': repr(parameters)[:MAX_PARAMETERS_LENGTH],
+        }
+        if has_request_context():
+            entry.update(endpoint=request.endpoint, method=request.method, path=request.full_path)
+        if not executemany and self.explainable(statement) and random.random() < self.explain_rate:
+            try:
+                entry['plan'] = explain(conn, statement, parameters)
+            except Exception as error:
+                entry['plan_error'] = str(error)
+        self.logger.warning(json.dumps(entry, default=str))
+
+    @staticmethod
+    def explainable(statement):
+        return statement.lstrip()[:6].upper() == 'SELECT'
+
+
+def explain(conn, statement, parameters):
+    """Return the plan of an already-run statement as a list of lines.
+
+    The plan is taken on the statement's own connection, through the DBAPI
+    so no events fire. It needs no second connection from a pool that may
+    be exhausted, and it sees the transaction's uncommitted rows.
+    """
+    dbapi_connection = conn.connection.dbapi_connection
+    cursor = dbapi_connection.cursor()
+    try:
+        if conn.dialect.name == 'postgresql':
+            if getattr(dbapi_connection, 'autocommit', False):
+                cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {statement}', parameters)
+                return [row[0] for row in cursor.fetchall()]
+            # Undoes whatever ANALYZE did, and an error, without touching the transaction
+            cursor.execute('SAVEPOINT slow_query_explain')
+            try:
+                cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {statement}', parameters)
+                return [row[0] for row in cursor.fetchall()]
+            finally:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+        if conn.dialect.name == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters)
+            return [row[-1] for row in cursor.fetchall()]
+        return None
+    finally:
+        cursor.close()
+
+
+@on_statement
+def _check_statement(conn, statement, parameters, executemany, elapsed):
+    if not has_app_context():
+        return
+    slow_queries = current_app.extensions.get('slow_query_log')
+    if slow_queries is not None and elapsed >= slow_queries.threshold:
+        slow_queries.record(conn, statement, parameters, elapsed, executemany)
+
+
+def init_app(app):
+    """Set up the slow-query log from SLOW_QUERY_* config, if it is enabled."""
+    threshold = app.config['SLOW_QUERY_THRESHOLD']
+    if threshold is None:
+        app.extensions['slow_query_log'] = None
+        return
+
+    path = app.config['SLOW_QUERY_LOG']
+    if path:
+        path = os.path.abspath(path)
+        if not any(getattr(handler, 'baseFilename', None) == path for handler in logger.handlers):
+            handler = RotatingFileHandler(
+                path,
+                maxBytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+                backupCount=app.config['SLOW_QUERY_LOG_BACKUPS'],
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(logging.WARNING)
+    app.extensions['slow_query_log'] = SlowQueryLog(threshold, app.config['SLOW_QUERY_EXPLAIN_RATE'])
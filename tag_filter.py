@@ -0,0 +1,44 @@
+"""Filtering posts by a boolean expression over their tags.
+
+`/posts?tags_all=1,2&tags_any=3,4&tags_not=5` returns posts carrying both
+tags 1 and 2, at least one of 3 and 4, and not 5. Each clause is an
+(NOT) EXISTS semi-join against posts_tags, answered from its primary key
+(post_id, tag_id) or the (tag_id, post_id) index, so no Tag.posts
+collection is ever loaded.
+"""
+
+from flask import abort
+
+from models import db, Post, PostTag
+
+FILTER_ARGS = ('tags_all', 'tags_any', 'tags_not')
+MAX_FILTER_TAGS = 20
+
+
+def parse_tag_ids(value):
+    """Parse a comma-separated list of tag ids, aborting with 400 on junk."""
+    if not value:
+        return []
+    try:
+        tag_ids = sorted({int(tag_id) for tag_id in value.split(',') if tag_id.strip()})
+    except ValueError:
+        abort(400, 'Tag ids must be comma-separated integers')
+    if len(tag_ids) > MAX_FILTER_TAGS:
+        abort(400, f'At most {MAX_FILTER_TAGS} tags per filter')
+    return tag_ids
+
+
+def _tagged(tag_ids):
+    """EXISTS clause for a post carrying any of `tag_ids`."""
+    return db.exists().where(PostTag.post_id == Post.id, PostTag.tag_id.in_(tag_ids))
+
+
+def filter_posts(query, tags_all=(), tags_any=(), tags_not=()):
+    """Restrict a query over posts to those matching the tag expression."""
+    for tag_id in tags_all:
+        query = query.filter(_tagged([tag_id]))
+    if tags_any:
+        query = query.filter(_tagged(tags_any))
+    if tags_not:
+        query = query.filter(~_tagged(tags_not))
+    return query
@@ -1,24 +1,147 @@
 import unittest
+from contextlib import contextmanager
 from flask import url_for, Flask
+from flask_sqlalchemy.session import Session
 from flask_testing import TestCase
+from sqlalchemy import event, func, insert, select
 from app import create_app, db, connect_db, User
+from cache import page_cache
+from databases import setup_database
+import feed
+import metrics
+
+_app = None
+
+
+def shared_app():
+    """Build the app, and the schema, once for the whole test run."""
+    global _app
+    if _app is None:
+        url, schema_ready = setup_database()
+        _app = create_app(db_url=url, testing=True)
+        connect_db(_app)
+        with _app.app_context():
+            if db.engine.dialect.name == 'sqlite':
+                enable_sqlite_savepoints(db.engine)
+            if not schema_ready:
+                db.drop_all()
+                db.create_all()
+    return _app
+
+
+def enable_sqlite_savepoints(engine):
+    """Let SQLAlchemy, not pysqlite, decide where transactions begin.
+
+    pysqlite defers BEGIN until the first write, so a SAVEPOINT would open
+    (and its RELEASE commit) the outer transaction instead of nesting in it.
+    """
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(conn):
+        # AUTOCOMMIT connections (the index and search commands) stay outside one
+        if conn.get_execution_options().get('isolation_level') != 'AUTOCOMMIT':
+            conn.exec_driver_sql('BEGIN')
+
+    engine.dispose()
+
+
+class TransactionSession(Session):
+    """Session pinned to the test's connection, whatever the model's bind."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        return bind if bind is not None else self.bind
+
 
 class BaseTest(TestCase):
+    # "transaction" runs each test inside a transaction that is rolled back,
+    # with the app's commits turned into SAVEPOINTs. Tests of code that opens
+    # its own connections (bulk import) use "truncate" instead: they commit
+    # for real and every table is emptied afterwards.
+    isolation = 'transaction'
+
     def create_app(self):
-        self.app = create_app(db_url='postgresql:///blogly_test', testing=True)
+        self.app = shared_app()
         return self.app
 
     def setUp(self):
-        connect_db(self.app)
-        with self.app.app_context():
-            db.create_all()
-            # create a user
-            db.session.add(User(first_name="Test", last_name="User", image_url="https://www.example.com"))
-            db.session.commit()
+        # Start every test with a cold page cache and feed, and no metrics
+        page_cache.init_app(self.app)
+        feed.init_app(self.app)
+        self.app.extensions['metrics'] = metrics.Metrics()
+
+        self._session = db.session
+        if self.isolation == 'transaction':
+            self.connection = db.engine.connect()
+            self.transaction = self.connection.begin()
+            db.session = db._make_scoped_session({
+                'class_': TransactionSession,
+                'bind': self.connection,
+                'join_transaction_mode': 'create_savepoint',
+            })
+
+        self.seed()
+        db.session.commit()
+        self.reset_sequences()
+
+    def seed(self):
+        """Insert the rows the class's tests start from, in bulk."""
+        # create a user
+        db.session.execute(insert(User), [
+            {'id': 1, 'first_name': 'Test', 'last_name': 'User', 'image_url': 'https://www.example.com'},
+        ])
+
+    def reset_sequences(self):
+        """Point Postgres id sequences just past the seeded rows.
+
+        Seed rows carry explicit ids so tests can name them, and sequences
+        are not rolled back with the data, so rows a test creates get the
+        same ids on every run.
+        """
+        if db.session.get_bind().dialect.name != 'postgresql':
+            return
+        for table in db.metadata.sorted_tables:
+            if 'id' in table.c:
+                db.session.execute(select(func.setval(
+                    func.pg_get_serial_sequence(table.name, 'id'),
+                    select(func.coalesce(func.max(table.c.id), 0) + 1).scalar_subquery(),
+                    False,
+                )))
 
     def tearDown(self):
         db.session.remove()
-        db.drop_all()
+        db.session = self._session
+        if self.isolation == 'transaction':
+            self.transaction.rollback()
+            self.connection.close()
+        else:
+            with db.engine.begin() as conn:
+                for table in reversed(db.metadata.sorted_tables):
+                    conn.execute(table.delete())
+
+    @contextmanager
+    def recorded_statements(self):
+        """Collect the SQL run inside the block, minus the fixture's savepoints."""
+        statements = []
+        def record(conn, cursor, statement, *args):
+            if 'SAVEPOINT' not in statement:
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+    @contextmanager
+    def assertMaxQueries(self, count):
+        """Fail if the block runs more than `count` statements, listing them."""
+        with self.recorded_statements() as statements:
+            yield statements
+        if len(statements) > count:
+            self.fail(f"{len(statements)} queries, expected at most {count}:\n" + "\n".join(statements))
 
     def test_setup(self):
-        self.assertTrue(True)
\ No newline at end of file
+        self.assertTrue(True)
@@ -0,0 +1,84 @@
+"""The database the test suite runs against.
+
+By default that is Postgres at $BLOGLY_TEST_DATABASE_URL, or
+postgresql:///blogly_test. Under pytest-xdist (`pytest -n 4`) that database
+becomes a template: the first worker builds the schema in it, and every
+worker then runs against its own clone, blogly_test_gw0, blogly_test_gw1
+and so on, made with CREATE DATABASE ... TEMPLATE.
+
+BLOGLY_TEST_BACKEND=sqlite runs the suite against in-memory SQLite
+instead, one database per process, for fast local iteration.
+"""
+
+import os
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+from models import db
+
+DEFAULT_URL = 'postgresql:///blogly_test'
+SQLITE_URL = 'sqlite://'
+# pg_advisory_lock key serializing workers while they build and clone
+TEMPLATE_LOCK = 0x626c6f67
+
+
+def setup_database():
+    """Return `(url, schema_ready)` for this test process.
+
+    `schema_ready` is False when the caller still has to create the tables.
+    """
+    if os.environ.get('BLOGLY_TEST_BACKEND', 'postgresql') == 'sqlite':
+        return SQLITE_URL, False
+
+    url = make_url(os.environ.get('BLOGLY_TEST_DATABASE_URL', DEFAULT_URL))
+    worker = os.environ.get('PYTEST_XDIST_WORKER')
+    if worker is None:
+        return url.render_as_string(hide_password=False), False
+    return clone_for_worker(url, worker), True
+
+
+def clone_for_worker(template, worker):
+    """Create this worker's copy of the template database and return its URL."""
+    clone = template.set(database=f"{template.database}_{worker}")
+    maintenance = create_engine(template.set(database='postgres'), isolation_level='AUTOCOMMIT')
+    try:
+        with maintenance.connect() as conn:
+            conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': TEMPLATE_LOCK})
+            try:
+                build_template(conn, template)
+                conn.exec_driver_sql(f'DROP DATABASE IF EXISTS "{clone.database}"')
+                conn.exec_driver_sql(f'CREATE DATABASE "{clone.database}" TEMPLATE "{template.database}"')
+            finally:
+                conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': TEMPLATE_LOCK})
+    finally:
+        maintenance.dispose()
+    return clone.render_as_string(hide_password=False)
+
+
+def build_template(conn, template):
+    """Rebuild the template's schema, once per test run.
+
+    The run's id is kept as the database's comment, so workers that take
+    the lock after the first one find the template already current.
+    """
+    run = os.environ.get('PYTEST_XDIST_TESTRUNUID', '')
+    exists = conn.execute(
+        text("SELECT shobj_description(oid, 'pg_database') FROM pg_database WHERE datname = :name"),
+        {'name': template.database},
+    ).first()
+    if exists is None:
+        conn.exec_driver_sql(f'CREATE DATABASE "{template.database}"')
+    elif run and exists[0] == run:
+        return
+
+    engine = create_engine(template)
+    try:
+        db.metadata.drop_all(engine)
+        db.metadata.create_all(engine)
+    finally:
+        # CREATE DATABASE ... TEMPLATE fails while anyone is connected to it
+        engine.dispose()
+    # COMMENT takes no bind parameters
+    comment = run.replace("'", "''")
+    conn.exec_driver_sql(f'COMMENT ON DATABASE "{template.database}" IS \'{comment}\'')
@@ -0,0 +1,138 @@
+import csv
+import io
+import json
+from BaseTest import *
+from models import Post, Tag, PostTag
+from datetime import datetime, timedelta
+
+
+class TestApi(BaseTest):
+    def seed(self):
+        super().seed()
+
+        # create 3 posts and 2 tags; post1: tag1, tag2 and post2: tag2
+        db.session.execute(insert(Post), [
+            {
+                "id": i,
+                "title": f"Test Post{i}",
+                "content": f"This is test post {i}",
+                "user_id": 1,
+                "created_at": datetime(2024, 1, 1) + timedelta(minutes=i),
+            }
+            for i in range(1, 4)
+        ])
+        db.session.execute(insert(Tag), [
+            {"id": 1, "name": "Tag1", "post_count": 1},
+            {"id": 2, "name": "Tag2", "post_count": 2},
+        ])
+        db.session.execute(insert(PostTag), [
+            {"post_id": 1, "tag_id": 1},
+            {"post_id": 1, "tag_id": 2},
+            {"post_id": 2, "tag_id": 2},
+        ])
+
+    def test_list_posts(self):
+        response = self.client.get(url_for("api_v1.posts"))
+        self.assert200(response)
+        self.assertEqual([post["id"] for post in response.json["data"]], [1, 2, 3])
+        self.assertEqual(response.json["data"][0]["title"], "Test Post1")
+        self.assertIsNone(response.json["next"])
+
+    def test_pagination(self):
+        response = self.client.get(url_for("api_v1.users"))
+        self.assertEqual(len(response.json["data"]), 1)
+
+        seen = []
+        after = None
+        while True:
+            response = self.client.get(url_for("api_v1.posts", per_page=2, after=after))
+            seen.extend(post["id"] for post in response.json["data"])
+            after = response.json["next"]
+            if after is None:
+                break
+        self.assertEqual(seen, [1, 2, 3])
+
+    def test_sparse_fieldset(self):
+        with self.recorded_statements() as statements:
+            response = self.client.get(url_for("api_v1.post", post_id=1, fields="title"))
+
+        self.assertEqual(response.json["data"], {"id": 1, "title": "Test Post1"})
+        # Columns the client did not ask for are never selected
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("content", statements[0])
+
+    def test_include(self):
+        with self.recorded_statements() as statements:
+            response = self.client.get(
+                url_for("api_v1.posts", include="user,tags", fields="title", **{"fields[users]": "first_name"})
+            )
+
+        self.assert200(response)
+        posts = response.json["data"]
+        self.assertEqual(posts[0], {"id": 1, "title": "Test Post1", "user": 1, "tags": [1, 2]})
+        self.assertEqual(posts[2]["tags"], [])
+        self.assertEqual(response.json["included"]["users"], [{"id": 1, "first_name": "Test"}])
+        self.assertEqual([tag["id"] for tag in response.json["included"]["tags"]], [1, 2])
+        # The posts, their users, the post-tag links and the tags
+        self.assertEqual(len(statements), 4)
+
+    def test_include_posts(self):
+        response = self.client.get(url_for("api_v1.tag", tag_id=2, include="posts", **{"fields[posts]": "title"}))
+        self.assertEqual(response.json["data"]["posts"], [1, 2])
+        self.assertEqual(response.json["included"]["posts"], [{"id": 1, "title": "Test Post1"}, {"id": 2, "title": "Test Post2"}])
+
+        response = self.client.get(url_for("api_v1.user", user_id=1, include="posts"))
+        self.assertEqual(response.json["data"]["posts"], [1, 2, 3])
+
+    def test_include_limit(self):
+        self.app.config["API_INCLUDE_LIMIT"] = 1
+        self.addCleanup(self.app.config.__setitem__, "API_INCLUDE_LIMIT", 20)
+
+        response = self.client.get(url_for("api_v1.tags", include="posts"))
+        tag1, tag2 = response.json["data"]
+        self.assertEqual((tag1["posts"], tag2["posts"]), ([1], [1]))
+        self.assertNotIn("links", tag1)
+        self.assertEqual([post["id"] for post in response.json["included"]["posts"]], [1])
+        # The rest of tag 2's posts are a page further on
+        response = self.client.get(tag2["links"]["posts"])
+        self.assertEqual(response.json["data"], [{"post_id": 2, "tag_id": 2}])
+        self.assertIsNone(response.json["next"])
+
+        response = self.client.get(url_for("api_v1.user", user_id=1, include="posts"))
+        self.assertEqual(response.json["data"]["posts"], [1])
+        response = self.client.get(response.json["data"]["links"]["posts"])
+        self.assertEqual([post["id"] for post in response.json["data"]], [2, 3])
+
+    def test_post_tags(self):
+        response = self.client.get(url_for("api_v1.post_tags", tag_id=2))
+        self.assertEqual(response.json["data"], [{"post_id": 1, "tag_id": 2}, {"post_id": 2, "tag_id": 2}])
+
+    def test_errors(self):
+        response = self.client.get(url_for("api_v1.post", post_id=99))
+        self.assert404(response)
+        self.assertIn("error", response.json)
+
+        self.assert400(self.client.get(url_for("api_v1.posts", fields="password")))
+        self.assert400(self.client.get(url_for("api_v1.posts", include="comments")))
+
+    def test_export_ndjson(self):
+        response = self.client.get(url_for("api_v1.export", table="posts"))
+        self.assert200(response)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([row["id"] for row in rows], [1, 2, 3])
+        self.assertEqual(rows[0]["title"], "Test Post1")
+
+    def test_export_csv(self):
+        response = self.client.get(url_for("api_v1.export", table="post_tags", format="csv"))
+        self.assert200(response)
+        rows = list(csv.reader(io.StringIO(response.data.decode())))
+        self.assertEqual(rows, [["post_id", "tag_id"], ["1", "1"], ["1", "2"], ["2", "2"]])
+
+        self.assert404(self.client.get(url_for("api_v1.export", table="secrets")))
+        self.assert400(self.client.get(url_for("api_v1.export", table="posts", format="xml")))
+
+    def test_export_cli(self):
+        result = self.app.test_cli_runner().invoke(args=["blogly", "export", "tags", "--format", "ndjson", "--batch-size", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual([json.loads(line)["name"] for line in result.output.splitlines()], ["Tag1", "Tag2"])
@@ -0,0 +1,173 @@
+import os
+import tempfile
+from BaseTest import *
+from models import Post, Tag, PostTag
+from datetime import datetime
+from cache import LRUBackend, FileSystemBackend
+
+
+class TestCache(BaseTest):
+    def seed(self):
+        super().seed()
+
+        # one user with post1 (tag1) and post2 (tag1, tag2)
+        db.session.execute(insert(Tag), [
+            {"id": 1, "name": "Tag1", "post_count": 2},
+            {"id": 2, "name": "Tag2", "post_count": 1},
+        ])
+        db.session.execute(insert(Post), [
+            {"id": 1, "title": "Test Post1", "content": "Post one", "user_id": 1, "created_at": datetime(2024, 1, 1)},
+            {"id": 2, "title": "Test Post2", "content": "Post two", "user_id": 1, "created_at": datetime(2024, 1, 2)},
+        ])
+        db.session.execute(insert(PostTag), [
+            {"post_id": 1, "tag_id": 1},
+            {"post_id": 2, "tag_id": 1},
+            {"post_id": 2, "tag_id": 2},
+        ])
+
+    def count_queries(self, url):
+        with self.recorded_statements() as statements:
+            response = self.client.get(url)
+        self.assert200(response)
+        return len(statements)
+
+    def test_cache_hit(self):
+        for url in ('/users', '/users/1', '/posts/1', '/tags', '/tags/1'):
+            self.assertGreater(self.count_queries(url), 0)
+            self.assertEqual(self.count_queries(url), 0)
+
+    def test_edit_tag_evicts_pages(self):
+        for url in ('/tags', '/tags/1', '/posts/1', '/posts/2', '/users/1'):
+            self.client.get(url)
+
+        self.client.post(url_for('edit_tag', tag_id=1), data={'name': 'Renamed'})
+
+        # The tag's page, the listing and the posts carrying it are rebuilt
+        for url in ('/tags', '/tags/1', '/posts/1', '/posts/2'):
+            self.assertIn(b'Renamed', self.client.get(url).data)
+        # The user page does not show tags and stays cached
+        self.assertEqual(self.count_queries('/users/1'), 0)
+
+    def test_edit_post_evicts_pages(self):
+        for url in ('/tags/1', '/tags/2', '/users/1', '/posts/1'):
+            self.client.get(url)
+
+        self.client.post(
+            url_for('edit_post', post_id=1),
+            data={'title': 'Edited Post1', 'content': 'Post one', 'tags': ['2']}
+        )
+
+        self.assertNotIn(b'Edited Post1', self.client.get('/tags/1').data)
+        self.assertIn(b'Edited Post1', self.client.get('/tags/2').data)
+        self.assertIn(b'Edited Post1', self.client.get('/users/1').data)
+        self.assertIn(b'Edited Post1', self.client.get('/posts/1').data)
+
+    def test_tag_page_dependencies_are_fixed(self):
+        self.client.get('/tags/1')
+        value, deps, size, expires = self.app.extensions['page_cache']._entries['/tags/1?']
+
+        # The same two tags however many posts carry the tag
+        self.assertEqual(deps, {'tag:1', 'tag-posts:1'})
+
+    def test_retitle_post_evicts_tag_pages(self):
+        for url in ('/tags/1', '/tags/2'):
+            self.client.get(url)
+
+        self.client.post(
+            url_for('edit_post', post_id=2),
+            data={'title': 'Edited Post2', 'content': 'Post two', 'tags': ['1', '2']}
+        )
+        for url in ('/tags/1', '/tags/2'):
+            self.assertIn(b'Edited Post2', self.client.get(url).data)
+
+        # Through the ORM, without the post's tags loaded
+        db.session.get(Post, 2).title = 'Retitled Post2'
+        db.session.commit()
+        for url in ('/tags/1', '/tags/2'):
+            self.assertIn(b'Retitled Post2', self.client.get(url).data)
+
+    def test_delete_post_evicts_tag_pages(self):
+        for url in ('/tags/1', '/tags/2'):
+            self.client.get(url)
+
+        self.client.post(url_for('delete_post', post_id=2))
+
+        for url in ('/tags/1', '/tags/2'):
+            self.assertNotIn(b'Test Post2', self.client.get(url).data)
+
+    def test_lru_bounds(self):
+        cache = LRUBackend(max_entries=2, max_bytes=10)
+        cache.set('a', (b'aaaa', 200, []), {'x'}, cache.generation)
+        cache.set('b', (b'bbbb', 200, []), {'x'}, cache.generation)
+        cache.get('a')
+        cache.set('c', (b'cccc', 200, []), {'y'}, cache.generation)
+
+        # 'b' was least recently used
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+        # Too big to fit at all
+        cache.set('d', (b'd' * 11, 200, []), {'y'}, cache.generation)
+        self.assertIsNone(cache.get('d'))
+
+        cache.invalidate({'x'})
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_stale_generation_is_not_stored(self):
+        cache = LRUBackend()
+        generation = cache.generation
+        cache.invalidate({'x'})
+        cache.set('a', (b'a', 200, []), {'x'}, generation)
+        self.assertIsNone(cache.get('a'))
+
+    def test_filesystem_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileSystemBackend(directory)
+            cache.set('a', (b'a', 200, []), {'x', 'y'}, cache.generation)
+            cache.set('b', (b'b', 200, []), {'y'}, cache.generation)
+            self.assertEqual(cache.get('a'), (b'a', 200, []))
+
+            cache.invalidate({'x'})
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(FileSystemBackend(directory).get('b'), (b'b', 200, []))
+
+    def test_entries_expire(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for cache in (LRUBackend(ttl=0), FileSystemBackend(directory, ttl=0)):
+                cache.set('a', (b'a', 200, []), {'x'}, cache.generation)
+                self.assertIsNone(cache.get('a'))
+
+            cache = FileSystemBackend(directory, ttl=60)
+            cache.set('b', (b'b', 200, []), {'x'}, cache.generation)
+            self.assertEqual(cache.get('b'), (b'b', 200, []))
+
+    def test_filesystem_bounds(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileSystemBackend(directory, max_entries=2)
+            for key in ('a', 'b', 'c'):
+                cache.set(key, (key.encode(), 200, []), {'x'}, cache.generation)
+                # Distinct mtimes, so the oldest entry is well defined
+                path = os.path.join(directory, 'entries', cache._name(key))
+                os.utime(path, (ord(key), ord(key)))
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.get('c'), (b'c', 200, []))
+            self.assertEqual(len(os.listdir(os.path.join(directory, 'entries'))), 2)
+            # The evicted page's tag marker went with it
+            self.assertEqual(len(os.listdir(os.path.join(directory, 'deps', cache._name('x')))), 2)
+
+    def test_filesystem_stale_generation_is_not_stored(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileSystemBackend(directory)
+            generation = cache.generation
+            # Another worker invalidates while this one renders
+            FileSystemBackend(directory).invalidate({'x'})
+            cache.set('a', (b'a', 200, []), {'x'}, generation)
+            self.assertIsNone(cache.get('a'))
+
+    def test_filesystem_refuses_shared_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.chmod(directory, 0o777)
+            with self.assertRaises(PermissionError):
+                FileSystemBackend(directory)
@@ -0,0 +1,92 @@
+from BaseTest import *
+from sqlalchemy import inspect
+from models import Post, Tag
+from search import search_posts
+from datetime import datetime
+
+
+class TestCli(BaseTest):
+    # The commands change the schema on their own connections
+    isolation = "truncate"
+
+    def run_cli(self, *args, exit_code=0):
+        result = self.app.test_cli_runner().invoke(args=["blogly", *args])
+        self.assertEqual(result.exit_code, exit_code, result.output)
+        return result
+
+    def execute(self, *statements):
+        with db.engine.begin() as conn:
+            for statement in statements:
+                conn.exec_driver_sql(statement)
+
+    def index_names(self, table):
+        return {index["name"] for index in inspect(db.engine).get_indexes(table)}
+
+    def test_create_indexes(self):
+        self.execute(
+            "DROP INDEX ix_posts_created_at_id_covering",
+            "DROP INDEX ix_posts_tags_tag_id_post_id",
+            # What the feed's index was called before it became covering
+            "CREATE INDEX ix_posts_created_at_id ON posts (created_at, id)",
+        )
+        self.assertNotIn("ix_posts_created_at_id_covering", self.index_names("posts"))
+
+        result = self.run_cli("create-indexes")
+        self.assertIn("Building index ix_posts_created_at_id_covering", result.output)
+        self.assertIn("Dropping retired index ix_posts_created_at_id", result.output)
+        self.assertIn("ix_posts_created_at_id_covering", self.index_names("posts"))
+        self.assertNotIn("ix_posts_created_at_id", self.index_names("posts"))
+        self.assertIn("ix_posts_tags_tag_id_post_id", self.index_names("posts_tags"))
+
+        # Running it again is harmless
+        self.run_cli("create-indexes")
+
+    def test_init_search(self):
+        self.execute(
+            "DROP TRIGGER posts_fts_insert",
+            "DROP TRIGGER posts_fts_delete",
+            "DROP TRIGGER posts_fts_update",
+            "DROP TABLE posts_fts",
+        )
+        db.session.add(Post(title="Before search", content="Written before search existed", user_id=1,
+                            created_at=datetime(2024, 1, 1)))
+        db.session.commit()
+
+        self.run_cli("init-search")
+
+        # Existing posts are indexed, and new ones through the triggers
+        self.assertEqual([row.title for row in search_posts("existed")], ["Before search"])
+        db.session.add(Post(title="After search", content="Written once search existed", user_id=1,
+                            created_at=datetime(2024, 1, 2)))
+        db.session.commit()
+        self.assertEqual(len(search_posts("existed")), 2)
+
+    def test_migrate_cascades_is_postgres_only(self):
+        result = self.run_cli("migrate-cascades", exit_code=1)
+        self.assertIn("Only needed on Postgres", result.output)
+
+    def test_add_timestamps(self):
+        # A database from before updated_at existed
+        self.execute(*(f"ALTER TABLE {table} DROP COLUMN updated_at" for table in ("users", "posts", "tags")))
+
+        result = self.run_cli("add-timestamps")
+        self.assertIn("Added users.updated_at", result.output)
+        for table in ("users", "posts", "tags"):
+            self.assertIn("updated_at", {column["name"] for column in inspect(db.engine).get_columns(table)})
+        self.assertEqual(self.run_cli("add-timestamps").output, "")
+
+        self.assertIsNotNone(db.session.get(User, 1).updated_at)
+        self.assert200(self.client.get(url_for("user_details", user_id=1)))
+
+    def test_recount_tags_adds_post_count(self):
+        db.session.add(Post(title="Tagged", content="Tagged post", user_id=1, created_at=datetime(2024, 1, 1),
+                            tags=[Tag(name="Tag1"), Tag(name="Tag2")]))
+        db.session.commit()
+        # A database from before post_count existed
+        self.execute("ALTER TABLE tags DROP COLUMN post_count")
+
+        result = self.run_cli("recount-tags")
+        self.assertIn("Added tags.post_count", result.output)
+        self.assertIn("Corrected 2 tag counts.", result.output)
+        self.assertEqual(dict(db.session.query(Tag.name, Tag.post_count)), {"Tag1": 1, "Tag2": 1})
+        self.assert200(self.client.get(url_for("tags")))
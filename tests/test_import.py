@@ -0,0 +1,112 @@
+import json
+import os
+import tempfile
+from BaseTest import *
+from unittest import mock
+from bulk_import import Checkpoint, import_file
+from models import Post, Tag, PostTag, ImportCheckpoint
+
+
+class TestImport(BaseTest):
+    # The importer commits each batch on its own connection
+    isolation = "truncate"
+
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+        super().tearDown()
+
+    def write(self, name, rows):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "w") as f:
+            if name.endswith(".csv"):
+                f.write("\n".join(",".join(row) for row in rows) + "\n")
+            else:
+                f.writelines(json.dumps(row) + "\n" for row in rows)
+        return path
+
+    def run_import(self, *args):
+        result = self.app.test_cli_runner().invoke(args=["blogly", "import", *args])
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result
+
+    def test_import_posts_and_tags(self):
+        posts = self.write("posts.csv", [
+            ["id", "title", "content", "created_at", "user_id"],
+            ["10", "Imported1", "First", "2024-01-01T10:00:00", "1"],
+            ["11", "Imported2", "", "2024-01-02T10:00:00", "1"],
+        ])
+        self.run_import("posts", posts, "--batch-size", "1")
+
+        post = db.session.get(Post, 11)
+        self.assertEqual(post.title, "Imported2")
+        self.assertEqual(post.content, "")
+        self.assertIsNotNone(post.updated_at)
+
+        # Tag names are resolved, creating the missing tags
+        db.session.add(Tag(name="Old"))
+        db.session.commit()
+        post_tags = self.write("post_tags.ndjson", [
+            {"post_id": 10, "tag": "Old"},
+            {"post_id": 10, "tag": "New"},
+            {"post_id": 11, "tag": "New"},
+        ])
+        self.run_import("post_tags", post_tags)
+
+        counts = dict(db.session.query(Tag.name, Tag.post_count))
+        self.assertEqual(counts, {"Old": 1, "New": 2})
+        self.assertEqual(db.session.query(PostTag).count(), 3)
+        self.assertEqual(db.session.query(ImportCheckpoint).count(), 0)
+
+    def test_import_resumes_from_checkpoint(self):
+        users = self.write("users.ndjson", [
+            {"first_name": "Skipped", "last_name": "User", "image_url": ""},
+            {"first_name": "Loaded", "last_name": "User", "image_url": ""},
+        ])
+        with db.engine.begin() as conn:
+            Checkpoint(users).save(conn, 1)
+
+        result = self.run_import("users", users)
+        self.assertIn("Resuming after 1 rows", result.output)
+        names = [user.first_name for user in db.session.query(User).order_by(User.id)]
+        self.assertEqual(names, ["Test", "Loaded"])
+
+    def test_import_unknown_column(self):
+        users = self.write("users.ndjson", [{"first_name": "A", "last_name": "B", "image_url": "", "password": "x"}])
+        result = self.app.test_cli_runner().invoke(args=["blogly", "import", "users", users])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Unknown users columns: password", result.output)
+        self.assertEqual(db.session.query(User).count(), 1)
+
+    def test_checkpoint_commits_with_its_batch(self):
+        users = self.write("users.ndjson", [
+            {"first_name": f"User{i}", "last_name": "Imported", "image_url": ""} for i in range(3)
+        ])
+        checkpoint = Checkpoint(users)
+        checkpoint.load()
+        save = checkpoint.save
+
+        def crash_on_second_batch(conn, rows):
+            save(conn, rows)
+            if rows == 2:
+                raise RuntimeError("crashed")
+
+        # A crash after the rows are written rolls back the batch and its count
+        with mock.patch.object(checkpoint, "save", crash_on_second_batch):
+            with self.assertRaises(RuntimeError):
+                import_file("users", users, "ndjson", batch_size=1, checkpoint=checkpoint)
+        self.assertEqual(checkpoint.load(), 1)
+
+        # So resuming loads every row exactly once
+        self.assertEqual(import_file("users", users, "ndjson", batch_size=1, checkpoint=checkpoint), 3)
+        names = [user.first_name for user in db.session.query(User).order_by(User.id)]
+        self.assertEqual(names, ["Test", "User0", "User1", "User2"])
+
+    def test_import_post_tag_without_tag(self):
+        post_tags = self.write("post_tags.ndjson", [{"post_id": 1}])
+        result = self.app.test_cli_runner().invoke(args=["blogly", "import", "post_tags", post_tags])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('post_tags row has neither a tag nor a tag_id: {"post_id": 1}', result.output)
@@ -0,0 +1,67 @@
+import re
+from BaseTest import *
+from models import Post, Tag, PostTag
+from datetime import datetime, timedelta
+
+
+class TestInstrumentation(BaseTest):
+    def seed(self):
+        # 3 users with 4 posts each, every post carrying 3 of 4 tags, so a
+        # per-row lazy load in any template blows the query budgets below
+        db.session.execute(insert(User), [
+            {"id": i, "first_name": "Test", "last_name": f"User{i}", "image_url": "https://www.example.com"}
+            for i in range(1, 4)
+        ])
+        db.session.execute(insert(Post), [
+            {
+                "id": i,
+                "title": f"Test Post{i}",
+                "content": f"This is test post {i}",
+                "user_id": (i - 1) // 4 + 1,
+                "created_at": datetime(2024, 1, 1) + timedelta(minutes=i),
+            }
+            for i in range(1, 13)
+        ])
+        links = [(post_id, tag_id) for post_id in range(1, 13) for tag_id in range(1, 5) if tag_id != post_id % 4 + 1]
+        db.session.execute(insert(Tag), [
+            {"id": i, "name": f"Tag{i}", "post_count": sum(1 for _, tag_id in links if tag_id == i)}
+            for i in range(1, 5)
+        ])
+        db.session.execute(insert(PostTag), [{"post_id": post_id, "tag_id": tag_id} for post_id, tag_id in links])
+
+    def test_server_timing_header(self):
+        response = self.client.get(url_for("users"))
+        self.assert200(response)
+        timing = response.headers["Server-Timing"]
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, app;dur=[\d.]+, total;dur=[\d.]+$')
+        self.assertGreater(float(re.search(r"tpl;dur=([\d.]+)", timing).group(1)), 0)
+
+        # A cache hit touches neither the database nor a template
+        timing = self.client.get(url_for("users")).headers["Server-Timing"]
+        self.assertIn('desc="0 queries"', timing)
+        self.assertIn("tpl;dur=0.0", timing)
+
+    def test_query_budgets(self):
+        # Each page costs a fixed number of queries, whatever it lists
+        budgets = [
+            (url_for("home"), 1),
+            (url_for("users"), 1),
+            (url_for("user_details", user_id=1), 3),
+            (url_for("posts"), 1),
+            (url_for("post_details", post_id=1), 3),
+            (url_for("tags"), 1),
+            (url_for("tag_details", tag_id=1), 3),
+            (url_for("edit_post", post_id=1), 3),
+            (url_for("api_v1.posts", include="user,tags"), 4),
+            (url_for("api_v1.users", include="posts"), 3),
+        ]
+        for url, count in budgets:
+            with self.subTest(url=url), self.assertMaxQueries(count):
+                self.assert200(self.client.get(url))
+
+    def test_assert_max_queries_fails(self):
+        with self.assertRaises(AssertionError) as failure:
+            with self.assertMaxQueries(0):
+                db.session.query(User).all()
+        self.assertIn("1 queries, expected at most 0", str(failure.exception))
+        self.assertIn("FROM users", str(failure.exception))
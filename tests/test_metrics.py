@@ -0,0 +1,90 @@
+import gc
+import re
+import threading
+from BaseTest import *
+from metrics import Metrics, render
+from pooling import pool_stats
+
+
+class TestMetrics(BaseTest):
+    def scrape(self):
+        response = self.client.get(url_for("prometheus_metrics"))
+        self.assert200(response)
+        self.assertEqual(response.content_type, "text/plain; version=0.0.4; charset=utf-8")
+        return response.get_data(as_text=True)
+
+    def sample(self, text, name, **labels):
+        """Return the value of one sample, or None if it is missing."""
+        label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+        pattern = re.escape(f"{name}{{{label_text}}}" if labels else name) + r" (\S+)$"
+        match = re.search(pattern, text, re.MULTILINE)
+        return float(match.group(1)) if match else None
+
+    def test_request_counts_and_histograms(self):
+        self.client.get(url_for("users"))
+        self.client.get(url_for("users"))
+        self.client.get(url_for("user_details", user_id=999))
+        text = self.scrape()
+
+        self.assertEqual(self.sample(text, "blogly_requests_total", endpoint="users", status=200), 2)
+        self.assertEqual(self.sample(text, "blogly_requests_total", endpoint="user_details", status=404), 1)
+        self.assertEqual(self.sample(text, "blogly_request_duration_seconds_count", endpoint="users"), 2)
+        self.assertEqual(self.sample(text, "blogly_request_duration_seconds_bucket", endpoint="users", le="+Inf"), 2)
+        self.assertEqual(self.sample(text, "blogly_response_size_bytes_count", endpoint="users"), 2)
+        self.assertGreater(self.sample(text, "blogly_response_size_bytes_sum", endpoint="users"), 0)
+        self.assertGreater(self.sample(text, "blogly_db_queries_total", endpoint="users"), 0)
+        self.assertIn("# TYPE blogly_request_duration_seconds histogram", text)
+
+    def test_page_cache_hits_and_misses(self):
+        self.client.get(url_for("users"))
+        self.client.get(url_for("users"))
+        self.client.get(url_for("users"))
+        text = self.scrape()
+        self.assertEqual(self.sample(text, "blogly_page_cache_requests_total", endpoint="users", result="miss"), 1)
+        self.assertEqual(self.sample(text, "blogly_page_cache_requests_total", endpoint="users", result="hit"), 2)
+
+    def test_pool_and_feed_metrics(self):
+        self.client.get(url_for("home"))
+        self.client.get(url_for("home"))
+        text = self.scrape()
+        recent_posts = self.app.extensions["recent_posts"]
+        self.assertEqual(self.sample(text, "blogly_feed_buffer_requests_total", result="hit"), recent_posts.hits)
+        self.assertEqual(self.sample(text, "blogly_feed_buffer_requests_total", result="miss"), recent_posts.misses)
+        if "size" in pool_stats(db.engine.pool):
+            self.assertIsNotNone(self.sample(text, "blogly_db_pool_checked_out"))
+
+    def test_label_values_are_escaped(self):
+        metrics = Metrics()
+        metrics.observe('say "hi"\\', 200, 0.01)
+        self.assertIn('endpoint="say \\"hi\\"\\\\"', render(metrics))
+
+    def test_threads_are_merged(self):
+        metrics = Metrics()
+        def work():
+            for _ in range(100):
+                metrics.observe("home", 200, 0.02, size=2000, queries=1)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        text = render(metrics)
+        self.assertEqual(self.sample(text, "blogly_requests_total", endpoint="home", status=200), 400)
+        self.assertEqual(self.sample(text, "blogly_db_queries_total", endpoint="home"), 400)
+        self.assertEqual(self.sample(text, "blogly_request_duration_seconds_bucket", endpoint="home", le=0.01), 0)
+        self.assertEqual(self.sample(text, "blogly_request_duration_seconds_bucket", endpoint="home", le=0.025), 400)
+        self.assertEqual(self.sample(text, "blogly_response_size_bytes_bucket", endpoint="home", le=4096), 400)
+
+    def test_exited_threads_are_retired(self):
+        metrics = Metrics()
+        for _ in range(20):
+            thread = threading.Thread(target=metrics.observe, args=("home", 200, 0.02))
+            thread.start()
+            thread.join()
+        gc.collect()
+
+        # A thread per request leaves no shards behind, and no counts lost
+        self.assertEqual(metrics._shards, [])
+        self.assertEqual(self.sample(render(metrics), "blogly_requests_total", endpoint="home", status=200), 20)
@@ -0,0 +1,85 @@
+import sqlite3
+import time
+from unittest import mock
+from BaseTest import *
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool
+from config import ProductionConfig
+from pooling import InstrumentedQueuePool, build_engine_options, pool_stats
+
+
+class TestPool(BaseTest):
+    def config(self, **overrides):
+        config = {key: getattr(ProductionConfig, key) for key in dir(ProductionConfig) if key.isupper()}
+        config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly'
+        config.update(overrides)
+        return config
+
+    def test_queue_pool_options(self):
+        options = build_engine_options(self.config(DB_POOL_SIZE=5, DB_MAX_OVERFLOW=2, DB_POOL_TIMEOUT=3))
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertEqual(options['pool_size'], 5)
+        self.assertEqual(options['max_overflow'], 2)
+        self.assertEqual(options['pool_timeout'], 3)
+        self.assertEqual(options['pool_recycle'], 1800)
+        self.assertTrue(options['pool_pre_ping'])
+
+    def test_null_pool_options(self):
+        options = build_engine_options(self.config(DB_POOL_CLASS='null', DB_POOL_SIZE=5))
+        self.assertIs(options['poolclass'], NullPool)
+        self.assertNotIn('pool_size', options)
+
+    def test_instrumented_pool_stats(self):
+        engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool, pool_size=2, max_overflow=1)
+        with engine.connect(), engine.connect():
+            stats = pool_stats(engine.pool)
+            self.assertEqual(stats['checked_out'], 2)
+            self.assertEqual(stats['overflow'], 0)
+            self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(pool_stats(engine.pool)['checked_out'], 0)
+        engine.dispose()
+
+    def test_wait_excludes_connecting(self):
+        def slow_connect():
+            time.sleep(0.2)
+            return sqlite3.connect(':memory:')
+
+        engine = create_engine('sqlite://', creator=slow_connect, poolclass=InstrumentedQueuePool,
+                               pool_size=1, max_overflow=0)
+        with engine.connect():
+            pass
+        stats = pool_stats(engine.pool)
+        self.assertEqual(stats['checkouts'], 1)
+        self.assertLess(stats['wait_total_seconds'], 0.1)
+        engine.dispose()
+
+    def test_retried_checkout_counts_once(self):
+        engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=1,
+                               pool_timeout=0.1)
+        pool = engine.pool
+        # Losing the race for the last overflow slot makes QueuePool retry
+        inc_overflow = pool._inc_overflow
+        attempts = []
+        def lose_first_race():
+            attempts.append(True)
+            return len(attempts) > 1 and inc_overflow()
+        with mock.patch.object(pool, '_inc_overflow', side_effect=lose_first_race):
+            with engine.connect():
+                pass
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(pool_stats(pool)['checkouts'], 1)
+
+        with engine.connect(), engine.connect():
+            with self.assertRaises(TimeoutError):
+                engine.connect()
+        stats = pool_stats(pool)
+        self.assertEqual(stats['checkouts'], 4)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertGreaterEqual(stats['wait_max_seconds'], 0.1)
+        engine.dispose()
+
+    def test_pool_stats_endpoint(self):
+        response = self.client.get(url_for('connection_pool_stats'))
+        self.assert200(response)
+        self.assertIn('pool', response.json)
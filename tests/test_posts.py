@@ -1,29 +1,23 @@
+import re
 from BaseTest import *
 from models import Post
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 class TestPosts(BaseTest):
-    def setUp(self):
-        connect_db(self.app)
-        with self.app.app_context():
-            db.create_all()
-
-            # create a user
-            db.session.add(User(first_name="Test", last_name="User", image_url="https://www.example.com"))
-            db.session.commit()
-
-            # create 5 posts: post1, post2, post3, post4, post5
-            for i in range(1, 6):
-                db.session.add(
-                    Post(
-                        title=f"Test Post{i}",
-                        content=f"This is test post {i}",
-                        user_id=db.session.query(User).first().id,
-                        created_at=datetime.now(),
-                    )
-                )
-            db.session.commit()
+    def seed(self):
+        super().seed()
+        # create 5 posts: post1, post2, post3, post4, post5, newest last
+        db.session.execute(insert(Post), [
+            {
+                "id": i,
+                "title": f"Test Post{i}",
+                "content": f"This is test post {i}",
+                "user_id": 1,
+                "created_at": datetime(2024, 1, 1) + timedelta(minutes=i),
+            }
+            for i in range(1, 6)
+        ])
 
     def test_get_posts(self):
         response = self.client.get(url_for("user_details", user_id=1))
@@ -87,3 +81,170 @@ class TestPosts(BaseTest):
 
         # Check that the post was deleted from the database
         self.assertIsNone(db.session.query(Post).get(1))
+
+    def test_post_not_modified(self):
+        response = self.client.get(url_for("post_details", post_id=1))
+        self.assert200(response)
+        etag = response.headers["ETag"]
+
+        # Revalidating from the cache and from the database both answer 304
+        for _ in range(2):
+            response = self.client.get(url_for("post_details", post_id=1), headers={"If-None-Match": etag})
+            self.assertStatus(response, 304)
+            self.assertEqual(response.data, b"")
+            self.app.extensions["page_cache"].clear()
+
+        # Editing the post changes the validator
+        self.client.post(
+            url_for("edit_post", post_id=1),
+            data={"title": "Edited Post1", "content": "This is test post 1"},
+        )
+        response = self.client.get(url_for("post_details", post_id=1), headers={"If-None-Match": etag})
+        self.assert200(response)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_user_not_modified(self):
+        response = self.client.get(url_for("user_details", user_id=1))
+        last_modified = response.headers["Last-Modified"]
+        self.app.extensions["page_cache"].clear()
+
+        response = self.client.get(url_for("user_details", user_id=1), headers={"If-Modified-Since": last_modified})
+        self.assertStatus(response, 304)
+
+    def test_missing_post(self):
+        self.assert404(self.client.get(url_for("post_details", post_id=99)))
+
+    def test_delete_missing_post(self):
+        self.assert404(self.client.post(url_for("delete_post", post_id=99)))
+
+    def test_search(self):
+        self.client.post(
+            url_for("new_post", user_id=1),
+            data={"title": "Gardening", "content": "Tomatoes need <sun> and water"},
+        )
+        response = self.client.get(url_for("search", q="tomatoes"))
+        self.assert200(response)
+        self.assertTemplateUsed("search.html")
+        self.assertIn(b"Gardening", response.data)
+        self.assertIn(b"<mark>Tomatoes</mark>", response.data)
+        self.assertIn(b"&lt;sun&gt;", response.data)
+        self.assertNotIn(b"Test Post1", response.data)
+
+        # Edited content is searchable, the old content is not
+        self.client.post(
+            url_for("edit_post", post_id=1),
+            data={"title": "Test Post1", "content": "Potatoes"},
+        )
+        self.assertIn(b"Test Post1", self.client.get(url_for("search", q="potatoes")).data)
+        self.assertNotIn(b"Test Post1", self.client.get(url_for("search", q="test post 1")).data)
+
+    def test_search_api_pagination(self):
+        # All five posts match; page through them two at a time
+        seen = []
+        after = None
+        while True:
+            response = self.client.get(url_for("api_search", q="test", per_page=2, after=after))
+            self.assert200(response)
+            seen.extend(result["id"] for result in response.json["results"])
+            after = response.json["next"]
+            if after is None:
+                break
+        self.assertEqual(sorted(seen), [1, 2, 3, 4, 5])
+
+    def test_search_pagination_with_tied_ranks(self):
+        db.session.execute(insert(Post), [
+            {"id": i, "title": "Same", "content": "Same words", "user_id": 1, "created_at": datetime(2024, 2, 1)}
+            for i in range(10, 16)
+        ])
+        db.session.commit()
+
+        pages = []
+        after = None
+        while True:
+            response = self.client.get(url_for("api_search", q="same", per_page=4, after=after))
+            results = response.json["results"]
+            pages.append([result["id"] for result in results])
+            after = response.json["next"]
+            if after is None:
+                break
+        self.assertEqual(len({result["rank"] for result in results}), 1)
+        self.assertEqual(sorted(id for page in pages for id in page), list(range(10, 16)))
+
+        # And back from the last page
+        response = self.client.get(url_for("api_search", q="same", per_page=4, before=response.json["prev"]))
+        self.assertEqual([result["id"] for result in response.json["results"]], pages[0])
+
+    def test_search_syntax_is_quoted(self):
+        response = self.client.get(url_for("api_search", q='post" OR (NEAR'))
+        self.assert200(response)
+
+    def test_home_feed(self):
+        response = self.client.get(url_for("home"))
+        self.assert200(response)
+        data = response.data.decode()
+        # Newest first, with the author
+        positions = [data.index(f"Test Post{i}") for i in range(5, 0, -1)]
+        self.assertEqual(positions, sorted(positions))
+        self.assertIn("Test User", data)
+
+    def test_home_feed_served_from_buffer(self):
+        self.client.get(url_for("home"))
+
+        with self.recorded_statements() as statements:
+            response = self.client.get(url_for("home"))
+
+        self.assert200(response)
+        self.assertEqual(statements, [])
+        self.assertEqual(self.app.extensions["recent_posts"].hits, 1)
+
+    def test_home_feed_follows_writes(self):
+        self.client.get(url_for("home"))
+
+        self.client.post(url_for("new_post", user_id=1), data={"title": "Test Post6", "content": "Six"})
+        self.client.post(url_for("edit_post", post_id=2), data={"title": "Edited Post2", "content": "Two"})
+        self.client.post(url_for("delete_post", post_id=3))
+        self.client.post(url_for("edit_user", user_id=1), data={"first_name": "Renamed", "last_name": "User", "image_url": ""})
+
+        response = self.client.get(url_for("home"))
+        self.assertEqual(self.app.extensions["recent_posts"].misses, 1)
+        self.assertIn(b"Test Post6", response.data)
+        self.assertIn(b"Edited Post2", response.data)
+        self.assertNotIn(b"Test Post3", response.data)
+        self.assertIn(b"Renamed User", response.data)
+
+    def test_home_feed_push_needs_no_author_query(self):
+        self.client.get(url_for("home"))
+
+        with self.recorded_statements() as statements:
+            self.client.post(url_for("new_post", user_id=1), data={"title": "Test Post6", "content": "Six"})
+        self.assertFalse(any("FROM users" in statement for statement in statements), statements)
+
+        # The author's name came from their other posts in the buffer
+        response = self.client.get(url_for("home"))
+        self.assertEqual(self.app.extensions["recent_posts"].hits, 1)
+        self.assertIn(b"Test Post6", response.data)
+
+    def test_home_feed_reloads_for_unknown_author(self):
+        self.client.get(url_for("home"))
+        db.session.execute(insert(User), [
+            {"id": 2, "first_name": "Other", "last_name": "Author", "image_url": "https://www.example.com"},
+        ])
+        db.session.commit()
+        db.session.expunge_all()
+
+        self.client.post(url_for("new_post", user_id=2), data={"title": "Test Post6", "content": "Six"})
+        response = self.client.get(url_for("home"))
+        self.assertEqual(self.app.extensions["recent_posts"].misses, 2)
+        self.assertIn(b"Other Author", response.data)
+
+    def test_home_feed_pagination(self):
+        response = self.client.get(url_for("home", per_page=2))
+        self.assertIn(b"Test Post5", response.data)
+        self.assertNotIn(b"Test Post3", response.data)
+        after = re.search(r'after=([^&"]+)', response.data.decode()).group(1)
+
+        response = self.client.get(f"/?after={after}&per_page=2")
+        self.assertIn(b"Test Post3", response.data)
+        self.assertIn(b"Test Post2", response.data)
+        self.assertNotIn(b"Test Post5", response.data)
+        self.assertIn(b"Newer", response.data)
@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+from BaseTest import *
+import slowlog
+
+
+class TestSlowLog(BaseTest):
+    def setUp(self):
+        super().setUp()
+        # Every statement is slow and every slow SELECT is explained
+        self.slow_queries = self.app.extensions["slow_query_log"]
+        self.saved = (self.slow_queries.threshold, self.slow_queries.explain_rate)
+        self.slow_queries.threshold = 0
+        self.slow_queries.explain_rate = 1.0
+
+    def tearDown(self):
+        self.slow_queries.threshold, self.slow_queries.explain_rate = self.saved
+        super().tearDown()
+
+    def entries(self, logs):
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_slow_query_logged_with_plan(self):
+        with self.assertLogs("blogly.slow_queries", level="WARNING") as logs:
+            self.assert200(self.client.get(url_for("user_details", user_id=1)))
+
+        entries = [entry for entry in self.entries(logs) if "FROM users" in entry["statement"]]
+        self.assertTrue(entries)
+        entry = entries[0]
+        self.assertEqual(entry["endpoint"], "user_details")
+        self.assertEqual(entry["path"], "/users/1?")
+        self.assertIn("1", entry["parameters"])
+        self.assertGreaterEqual(entry["duration_ms"], 0)
+        self.assertTrue(entry["plan"])
+
+    def test_plan_taken_inside_the_transaction(self):
+        db.session.add(User(id=2, first_name="Uncommitted", last_name="User", image_url=""))
+        db.session.flush()
+        with self.assertLogs("blogly.slow_queries", level="WARNING") as logs:
+            self.assertEqual(db.session.get(User, 2, populate_existing=True).first_name, "Uncommitted")
+
+        self.assertTrue(self.entries(logs)[-1]["plan"])
+        # The explain left the transaction and its pending row alone
+        db.session.commit()
+        self.assertEqual(db.session.query(User).count(), 2)
+
+    def test_only_selects_explained(self):
+        with self.assertLogs("blogly.slow_queries", level="WARNING") as logs:
+            self.client.post(url_for("edit_user", user_id=1), data={"first_name": "A", "last_name": "B", "image_url": ""})
+
+        updates = [entry for entry in self.entries(logs) if entry["statement"].startswith("UPDATE users")]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn("plan", updates[0])
+
+    def test_fast_queries_not_logged(self):
+        self.slow_queries.threshold = 60
+        with self.assertNoLogs("blogly.slow_queries", level="WARNING"):
+            self.client.get(url_for("user_details", user_id=1))
+
+    def test_rotating_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "slow.log")
+            app = Flask(__name__)
+            app.config.update(
+                SLOW_QUERY_THRESHOLD=0.1,
+                SLOW_QUERY_EXPLAIN_RATE=0,
+                SLOW_QUERY_LOG=path,
+                SLOW_QUERY_LOG_MAX_BYTES=1024,
+                SLOW_QUERY_LOG_BACKUPS=2,
+            )
+            slowlog.init_app(app)
+            handler = slowlog.logger.handlers[-1]
+            try:
+                self.assertEqual(handler.baseFilename, path)
+                self.assertEqual(handler.maxBytes, 1024)
+                app.extensions["slow_query_log"].logger.warning("entry")
+                with open(path) as f:
+                    self.assertEqual(f.read(), "entry\n")
+            finally:
+                slowlog.logger.removeHandler(handler)
+                handler.close()
+                slowlog.logger.propagate = True
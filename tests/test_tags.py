@@ -1,50 +1,38 @@
+import re
 from BaseTest import *
 from models import Post, Tag, PostTag
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
 
 class TestTags(BaseTest):
-    def setUp(self):
-        connect_db(self.app)
-        with self.app.app_context():
-            db.create_all()
-
-            # create a user
-            db.session.add(User(first_name="Test", last_name="User", image_url="https://www.example.com"))
-            db.session.commit()
-
-            # create 5 posts: post1, post2, post3, post4, post5
-            for i in range(1, 6):
-                db.session.add(
-                    Post(
-                        title=f"Test Post{i}",
-                        content=f"This is test post {i}",
-                        user_id=db.session.query(User).first().id,
-                        created_at=datetime.now(),
-                    )
-                )
-            db.session.commit()
-
-            # create 5 tags: tag1, tag2, tag3, tag4, tag5
-            for i in range(1, 6):
-                db.session.add(Tag(name=f"Tag{i}"))
-            db.session.commit()
-
-            # add tags to posts
-            # post1: tag1, tag2
-            # post2: tag2, tag3
-            # post3: tag3, tag4
-            # post4: tag4, tag5
-            for i in range(1, 5):
-                db.session.add(PostTag(post_id=i, tag_id=i))
-                db.session.add(PostTag(post_id=i, tag_id=i+1))
-
-            # post5: tag1, tag2, tag3, tag4, tag5
-            post = db.session.query(Post).get(5)
-            for i in range(1, 6):
-                tag = db.session.query(Tag).get(i)
-                post.tags.append(tag)
-                db.session.add(post)
-            db.session.commit()
+    def seed(self):
+        super().seed()
+        # create 5 posts: post1, post2, post3, post4, post5, newest last
+        db.session.execute(insert(Post), [
+            {
+                "id": i,
+                "title": f"Test Post{i}",
+                "content": f"This is test post {i}",
+                "user_id": 1,
+                "created_at": datetime(2024, 1, 1) + timedelta(minutes=i),
+            }
+            for i in range(1, 6)
+        ])
+
+        # add tags to posts
+        # post1: tag1, tag2
+        # post2: tag2, tag3
+        # post3: tag3, tag4
+        # post4: tag4, tag5
+        # post5: tag1, tag2, tag3, tag4, tag5
+        links = [(i, j) for i in range(1, 5) for j in (i, i + 1)] + [(5, j) for j in range(1, 6)]
+        counts = Counter(tag_id for _, tag_id in links)
+
+        # create 5 tags: tag1, tag2, tag3, tag4, tag5
+        db.session.execute(insert(Tag), [
+            {"id": i, "name": f"Tag{i}", "post_count": counts[i]} for i in range(1, 6)
+        ])
+        db.session.execute(insert(PostTag), [{"post_id": post_id, "tag_id": tag_id} for post_id, tag_id in links])
 
     def test_relationships(self):
         # Check that post5 has tag1, tag2, tag3, tag4, tag5
@@ -128,4 +116,157 @@ class TestTags(BaseTest):
 
         # Tag with id = 2 is no longer in the database
         self.assertEqual(len(db.session.query(Tag).all()), 4)
-        self.assertIsNone(db.session.query(Tag).get(2))
\ No newline at end of file
+        self.assertIsNone(db.session.query(Tag).get(2))
+
+    def test_new_post_with_tags(self):
+        # Create a post tagged with tag1 and tag3
+        response = self.client.post(
+            url_for('new_post', user_id=1),
+            data={'title': 'Tagged Post', 'content': 'Has tags', 'tags': ['1', '3']},
+            follow_redirects=True
+        )
+        self.assert200(response)
+
+        post = db.session.query(Post).filter_by(title='Tagged Post').one()
+        self.assertEqual(sorted(tag.id for tag in post.tags), [1, 3])
+
+    def test_new_post_unknown_tag(self):
+        # Unknown tag ids are rejected and nothing is saved
+        response = self.client.post(
+            url_for('new_post', user_id=1),
+            data={'title': 'Bad Tags', 'content': 'Unknown tag', 'tags': ['1', '99']}
+        )
+        self.assert400(response)
+        self.assertIsNone(db.session.query(Post).filter_by(title='Bad Tags').first())
+
+    def test_edit_post_tags(self):
+        # post1 goes from tag1, tag2 to tag2, tag4
+        response = self.client.post(
+            url_for('edit_post', post_id=1),
+            data={'title': 'Test Post1', 'content': 'This is test post 1', 'tags': ['2', '4']},
+            follow_redirects=True
+        )
+        self.assert200(response)
+        self.assertIn(b'Tag4', response.data)
+        self.assertNotIn(b'Tag1', response.data)
+
+        post = db.session.query(Post).get(1)
+        self.assertEqual(sorted(tag.id for tag in post.tags), [2, 4])
+
+    def test_edit_post_unchanged_tags(self):
+        # Saving a post without changing its tags leaves posts_tags alone
+        with self.recorded_statements() as statements:
+            response = self.client.post(
+                url_for('edit_post', post_id=1),
+                data={'title': 'Test Post1', 'content': 'Edited', 'tags': ['1', '2']}
+            )
+
+        self.assertStatus(response, 302)
+        self.assertFalse([s for s in statements if s.startswith(('INSERT INTO posts_tags', 'DELETE FROM posts_tags'))])
+        self.assertEqual(sorted(tag.id for tag in db.session.query(Post).get(1).tags), [1, 2])
+
+    def test_delete_user_cascades(self):
+        # Deleting the user is a single DELETE; the database removes the
+        # user's posts and their tag assignments
+        self.client.get(url_for('tag_details', tag_id=1))
+        with self.recorded_statements() as statements:
+            response = self.client.post(url_for('delete_user', user_id=1))
+
+        self.assertStatus(response, 302)
+        self.assertEqual(len([s for s in statements if s.startswith('DELETE')]), 1)
+        self.assertEqual(db.session.query(Post).count(), 0)
+        self.assertEqual(db.session.query(PostTag).count(), 0)
+        self.assertEqual(db.session.query(Tag).count(), 5)
+
+        # Tag pages no longer list the deleted posts
+        self.assertNotIn(b'Test Post1', self.client.get(url_for('tag_details', tag_id=1)).data)
+
+    def test_delete_missing_user(self):
+        self.assert404(self.client.post(url_for('delete_user', user_id=99)))
+
+    def test_delete_tag_skips_collection(self):
+        # Deleting a tag never loads its posts
+        with self.recorded_statements() as statements:
+            response = self.client.post(url_for('delete_tag', tag_id=2))
+
+        self.assertStatus(response, 302)
+        self.assertEqual(statements, [s for s in statements if s.startswith('DELETE')])
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(db.session.query(PostTag).filter_by(tag_id=2).count(), 0)
+
+        # Post pages no longer show the tag
+        self.assertNotIn(b'Tag2', self.client.get(url_for('post_details', post_id=1)).data)
+
+    def test_delete_missing_tag(self):
+        self.assert404(self.client.post(url_for('delete_tag', tag_id=99)))
+
+    def assertCountsMatch(self):
+        # The denormalized counts agree with the posts_tags rows
+        actual = dict(
+            db.session.query(Tag.id, db.func.count(PostTag.post_id))
+            .outerjoin(PostTag, PostTag.tag_id == Tag.id).group_by(Tag.id)
+        )
+        db.session.expire_all()
+        self.assertEqual(dict(db.session.query(Tag.id, Tag.post_count)), actual)
+
+    def test_tag_listing_counts(self):
+        for mode in ('denormalized', 'aggregate'):
+            self.app.config['TAG_POST_COUNTS'] = mode
+            self.app.extensions['page_cache'].clear()
+            response = self.client.get(url_for('tags'))
+            self.assert200(response)
+
+            # Most used first, ties by name
+            text = response.text
+            order = [text.index(f'Tag{i}<') for i in (2, 3, 4, 1, 5)]
+            self.assertEqual(order, sorted(order))
+        self.assertCountsMatch()
+
+    def test_tag_counts_maintained(self):
+        self.client.post(
+            url_for('new_post', user_id=1),
+            data={'title': 'Tagged Post', 'content': 'Has tags', 'tags': ['1', '5']}
+        )
+        self.assertCountsMatch()
+
+        self.client.post(
+            url_for('edit_post', post_id=5),
+            data={'title': 'Test Post5', 'content': 'Fewer tags', 'tags': ['1']}
+        )
+        self.assertCountsMatch()
+
+        self.client.post(url_for('delete_post', post_id=1))
+        self.assertCountsMatch()
+        self.assertEqual(db.session.query(Tag).get(1).post_count, 2)
+
+        self.client.post(url_for('delete_user', user_id=1))
+        self.assertCountsMatch()
+        self.assertEqual(db.session.query(Tag).get(1).post_count, 0)
+
+    def filtered_titles(self, **args):
+        response = self.client.get(url_for('posts', **args))
+        self.assert200(response)
+        return {f'Test Post{i}' for i in range(1, 6) if f'Test Post{i}<' in response.text}
+
+    def test_filter_posts_by_tags(self):
+        self.assertEqual(self.filtered_titles(), {f'Test Post{i}' for i in range(1, 6)})
+        self.assertEqual(self.filtered_titles(tags_all='2,3'), {'Test Post2', 'Test Post5'})
+        self.assertEqual(self.filtered_titles(tags_any='1,4'), {'Test Post1', 'Test Post3', 'Test Post4', 'Test Post5'})
+        self.assertEqual(self.filtered_titles(tags_not='2'), {'Test Post3', 'Test Post4'})
+        self.assertEqual(
+            self.filtered_titles(tags_all='4', tags_any='3,5', tags_not='1'),
+            {'Test Post3', 'Test Post4'}
+        )
+
+    def test_filter_posts_pagination(self):
+        # Page through posts carrying tag 2 one at a time, keeping the filter
+        response = self.client.get(url_for('posts', tags_any='2', per_page=1))
+        seen = [re.search(r'>(Test Post\d)<', response.text).group(1)]
+        while 'after=' in response.text:
+            next_url = re.search(r'href="(/posts\?[^"]*after=[^"]*)"', response.text).group(1)
+            response = self.client.get(next_url.replace('&amp;', '&'))
+            seen.append(re.search(r'>(Test Post\d)<', response.text).group(1))
+        self.assertEqual(sorted(seen), ['Test Post1', 'Test Post2', 'Test Post5'])
+
+    def test_filter_posts_bad_ids(self):
+        self.assert400(self.client.get(url_for('posts', tags_all='1,two')))
@@ -1,15 +1,14 @@
+import re
 from BaseTest import *
+from pagination import encode_cursor
 
 class TestUsers(BaseTest):
-    def setUp(self):
-        connect_db(self.app)
-        with self.app.app_context():
-            db.create_all()
-
-            # create 5 users: user1, user2, user3, user4, user5
-            for i in range(1, 6):
-                db.session.add(User(first_name=f'Test', last_name=f'User{i}', image_url=f'http://example{i}.com'))
-            db.session.commit()
+    def seed(self):
+        # create 5 users: user1, user2, user3, user4, user5
+        db.session.execute(insert(User), [
+            {"id": i, "first_name": "Test", "last_name": f"User{i}", "image_url": f"http://example{i}.com"}
+            for i in range(1, 6)
+        ])
 
     def test_home(self):
         response = self.client.get(url_for('home'))
@@ -27,6 +26,41 @@ class TestUsers(BaseTest):
         self.assertIn('Test User5', response.text)
         self.assertNotIn('Test User6', response.text)
 
+    def test_user_listing_pagination(self):
+        # First page, ordered by last name
+        response = self.client.get(url_for('users', per_page=2))
+        self.assert200(response)
+        self.assertIn('Test User1', response.text)
+        self.assertIn('Test User2', response.text)
+        self.assertNotIn('Test User3', response.text)
+        self.assertNotIn('Previous', response.text)
+
+        # Follow the "Next" link
+        after = re.search(r'after=([\w-]+)', response.text).group(1)
+        response = self.client.get(url_for('users', per_page=2, after=after))
+        self.assert200(response)
+        self.assertNotIn('Test User2', response.text)
+        self.assertIn('Test User3', response.text)
+        self.assertIn('Test User4', response.text)
+
+        # And back again with the "Previous" link
+        before = re.search(r'before=([\w-]+)', response.text).group(1)
+        response = self.client.get(url_for('users', per_page=2, before=before))
+        self.assert200(response)
+        self.assertIn('Test User1', response.text)
+        self.assertIn('Test User2', response.text)
+        self.assertNotIn('Test User3', response.text)
+
+    def test_user_listing_bad_cursor(self):
+        response = self.client.get(url_for('users', after='not-a-cursor'))
+        self.assert400(response)
+
+        # Well-formed cursors whose values do not fit the sort columns
+        for values in ([{"a": 1}, "b", 1], ["User", "Test", "1"], ["User", "Test", True], ["User", None, 1]):
+            with self.subTest(values=values):
+                response = self.client.get(url_for('users', after=encode_cursor(values)))
+                self.assert400(response)
+
     def test_new_user(self):
         # GET request, should get the form
         response = self.client.get(url_for('new_user'))